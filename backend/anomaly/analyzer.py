@@ -1,26 +1,42 @@
 from .ml_models import anomaly_detector
 from documents.access_log import get_access_logs
-from db import get_db_connection
+from db import get_thread_connection, get_ist_timestamp_ago, timestamps_to_epoch_ns, NAT_NS, INDIA_TIMEZONE, IST_OFFSET_SECONDS
 from typing import Dict, List
-import pandas as pd
-from datetime import datetime, timedelta
-import pytz # Import pytz
+from collections import Counter
+from cachetools import TTLCache
+import numpy as np
+import threading
+from datetime import datetime
 
-INDIA_TIMEZONE = pytz.timezone('Asia/Kolkata') # Define Indian timezone
+# Baselines over the last 100 logs barely move between calls; log_access
+# drops a user's entry whenever they generate a new log
+_baseline_cache = TTLCache(maxsize=10_000, ttl=60)
+_baseline_cache_lock = threading.Lock()
 
 def analyze_access_pattern(user_id: int, action: str, department: str = None) -> float:
     """Analyze access pattern and return risk score"""
     
-    # Get recent access logs for training/analysis
-    recent_logs = get_access_logs(limit=1000)
+    # A fresh process starts from the bundle an earlier run saved
+    if not anomaly_detector.is_trained:
+        anomaly_detector.load_models()
     
-    if len(recent_logs) < 50:
-        # Not enough data for meaningful analysis
-        return 0.0
+    # Only fetch recent access logs when the model is missing or stale. One
+    # thread retrains; the others keep scoring with the current model, and
+    # only wait for the retrain when there is no model yet
+    if anomaly_detector.needs_training():
+        lock = anomaly_detector.training_lock
+        if lock.acquire(blocking=not anomaly_detector.is_trained):
+            try:
+                if anomaly_detector.needs_training():
+                    recent_logs = get_access_logs(limit=1000, as_arrays=True)
+                    if len(recent_logs['user_id']) >= 50:
+                        anomaly_detector.train_from_arrays(recent_logs)
+            finally:
+                lock.release()
     
-    # Train model if not already trained
     if not anomaly_detector.is_trained:
-        anomaly_detector.train(recent_logs)
+        # Not enough data for meaningful analysis
+        return 0.0
     
     # Create current access log entry with IST timestamp
     current_log = {
@@ -35,126 +51,161 @@ def analyze_access_pattern(user_id: int, action: str, department: str = None) ->
     
     return risk_score
 
-def get_user_behavior_baseline(user_id: int) -> Dict:
-    """Get user's typical behavior pattern"""
-    conn = get_db_connection()
+def invalidate_user_baseline(user_id: int):
+    """Forget the cached behavior baseline for a user"""
+    with _baseline_cache_lock:
+        _baseline_cache.pop(user_id, None)
+
+def get_user_behavior_baseline(user_id: int, conn=None) -> Dict:
+    """Get user's typical behavior pattern, cached for a minute"""
+    with _baseline_cache_lock:
+        baseline = _baseline_cache.get(user_id)
+    if baseline is not None:
+        return baseline
+    
+    baseline = _compute_user_behavior_baseline(user_id, conn)
+    with _baseline_cache_lock:
+        _baseline_cache[user_id] = baseline
+    return baseline
+
+def _compute_user_behavior_baseline(user_id: int, conn=None) -> Dict:
+    """Compute user's typical behavior pattern from recent access logs"""
+    if conn is None:
+        conn = get_thread_connection()
     cursor = conn.cursor()
     
-    try:
-        # Get user's access history
-        cursor.execute('''
-            SELECT * FROM access_logs 
-            WHERE user_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        ''', (user_id,))
-        
-        logs = [dict(row) for row in cursor.fetchall()]
-        
-        if not logs:
-            return {}
-        
-        df = pd.DataFrame(logs)
-        # Convert timestamp to timezone-aware IST
-        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(pytz.utc).dt.tz_convert(INDIA_TIMEZONE)
-        df['hour'] = df['timestamp'].dt.hour
-        
-        # Calculate baseline metrics
-        baseline = {
-            'avg_daily_accesses': len(df) / max(1, df['timestamp'].dt.date.nunique()),
-            'common_hours': df['hour'].mode().tolist(),
-            'common_actions': df['action'].value_counts().to_dict(),
-            'avg_risk_score': df['risk_score'].mean()
-        }
-        
-        return baseline
-        
-    finally:
-        conn.close()
+    # Get user's access history, only the columns the baseline needs
+    cursor.execute('''
+        SELECT timestamp, action, risk_score FROM access_logs 
+        WHERE user_id = ? 
+        ORDER BY timestamp DESC 
+        LIMIT 100
+    ''', (user_id,))
+    
+    rows = cursor.fetchall()
+    
+    if not rows:
+        return {}
+    
+    # Timestamps as seconds since epoch shifted to IST (naive values are UTC)
+    epoch_ns = timestamps_to_epoch_ns([row[0] for row in rows])
+    epoch_ns = epoch_ns[epoch_ns != NAT_NS]
+    ist_seconds = epoch_ns // 1_000_000_000 + IST_OFFSET_SECONDS
+    hours = (ist_seconds // 3600) % 24
+    days = ist_seconds // 86400
+    
+    # Most frequent hour(s), ascending like pandas' mode()
+    hour_counts = Counter(hours.tolist())
+    top_count = max(hour_counts.values(), default=0)
+    common_hours = sorted(hour for hour, count in hour_counts.items() if count == top_count)
+    
+    risk_scores = np.array([row[2] for row in rows], dtype=np.float64)
+    
+    # Calculate baseline metrics
+    baseline = {
+        'avg_daily_accesses': len(rows) / max(1, len(np.unique(days))),
+        'common_hours': common_hours,
+        'common_actions': dict(Counter(row[1] for row in rows).most_common()),
+        'avg_risk_score': float(np.nanmean(risk_scores))
+    }
+    
+    return baseline
 
-def detect_bulk_operations(user_id: int, time_window_minutes: int = 30) -> Dict:
+def detect_bulk_operations(user_id: int, time_window_minutes: int = 30, conn=None) -> Dict:
     """Detect if user is performing bulk operations"""
-    conn = get_db_connection()
+    if conn is None:
+        conn = get_thread_connection()
     cursor = conn.cursor()
     
-    try:
-        # Get recent activities within time window (convert to UTC for comparison with DB)
-        since_time = datetime.now(INDIA_TIMEZONE) - timedelta(minutes=time_window_minutes)
-        
-        cursor.execute('''
-            SELECT action, COUNT(*) as count
-            FROM access_logs 
-            WHERE user_id = ? AND timestamp >= ?
-            GROUP BY action
-        ''', (user_id, since_time.isoformat())) # Store in ISO format
-        
-        activities = dict(cursor.fetchall())
-        
-        # Define thresholds for bulk operations
-        thresholds = {
-            'read': 20,
-            'upload': 10,
-            'delete': 5
-        }
-        
-        bulk_detected = False
-        risk_factors = []
-        
-        for action, count in activities.items():
-            threshold = thresholds.get(action, 15)
-            if count >= threshold:
-                bulk_detected = True
-                risk_factors.append(f"{count} {action} operations in {time_window_minutes} minutes")
-        
-        return {
-            'bulk_detected': bulk_detected,
-            'activities': activities,
-            'risk_factors': risk_factors,
-            'risk_score': 0.8 if bulk_detected else 0.0
-        }
-        
-    finally:
-        conn.close()
+    # Get recent activities within time window, in the stored IST format
+    since_time = get_ist_timestamp_ago(minutes=time_window_minutes)
+    
+    # Only actions over their bulk threshold come back from the database
+    cursor.execute('''
+        WITH thresholds(action, threshold) AS (
+            VALUES ('read', 20), ('upload', 10), ('delete', 5)
+        )
+        SELECT al.action, COUNT(*) as count
+        FROM access_logs al
+        LEFT JOIN thresholds t ON t.action = al.action
+        WHERE al.user_id = ? AND al.timestamp >= ?
+        GROUP BY al.action
+        HAVING COUNT(*) >= COALESCE(MAX(t.threshold), 15)
+    ''', (user_id, since_time))
+    
+    activities = dict(cursor.fetchall())
+    
+    bulk_detected = bool(activities)
+    risk_factors = [f"{count} {action} operations in {time_window_minutes} minutes"
+                    for action, count in activities.items()]
+    
+    return {
+        'bulk_detected': bulk_detected,
+        'activities': activities,
+        'risk_factors': risk_factors,
+        'risk_score': 0.8 if bulk_detected else 0.0
+    }
 
-def check_department_access_violations(user_id: int) -> List[Dict]:
-    """Check for cross-department access violations"""
-    conn = get_db_connection()
+def count_department_access_violations(user_id: int, conn=None) -> int:
+    """Count the user's accesses to documents of other departments"""
+    if conn is None:
+        conn = get_thread_connection()
     cursor = conn.cursor()
     
-    try:
-        # Get user's department
-        cursor.execute("SELECT department FROM users WHERE id = ?", (user_id,))
-        user_dept = cursor.fetchone()
-        
-        if not user_dept:
-            return []
-        
-        user_department = user_dept['department']
-        
-        # Find access to other departments
-        cursor.execute('''
-            SELECT al.*, d.department as doc_department
-            FROM access_logs al
-            LEFT JOIN documents d ON al.doc_id = d.id
-            WHERE al.user_id = ? 
-            AND d.department IS NOT NULL 
-            AND d.department != ?
-            ORDER BY al.timestamp DESC
-            LIMIT 10
-        ''', (user_id, user_department))
-        
-        violations = [dict(row) for row in cursor.fetchall()]
-        
-        return violations
-        
-    finally:
-        conn.close()
+    # Unknown users have no department, so nothing compares as a violation
+    cursor.execute('''
+        SELECT COUNT(*)
+        FROM access_logs al
+        JOIN documents d ON al.doc_id = d.id
+        WHERE al.user_id = ? 
+        AND d.department != (SELECT department FROM users WHERE id = ?)
+    ''', (user_id, user_id))
+    
+    return cursor.fetchone()[0]
+
+def list_department_access_violations(user_id: int, limit: int = 10, conn=None) -> List[Dict]:
+    """List the user's most recent cross-department access violations"""
+    if conn is None:
+        conn = get_thread_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None # plain tuples, zipped with the column names below
+    
+    # Get user's department
+    cursor.execute("SELECT department FROM users WHERE id = ?", (user_id,))
+    user_dept = cursor.fetchone()
+    
+    if not user_dept:
+        return []
+    
+    user_department = user_dept[0]
+    
+    # Find access to other departments
+    cursor.execute('''
+        SELECT al.*, d.department as doc_department
+        FROM access_logs al
+        LEFT JOIN documents d ON al.doc_id = d.id
+        WHERE al.user_id = ? 
+        AND d.department IS NOT NULL 
+        AND d.department != ?
+        ORDER BY al.timestamp DESC
+        LIMIT ?
+    ''', (user_id, user_department, limit))
+    
+    columns = [column[0] for column in cursor.description]
+    violations = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    return violations
 
-def generate_risk_report(user_id: int) -> Dict:
+def generate_risk_report(user_id: int, include_violations: bool = True) -> Dict:
     """Generate comprehensive risk report for user"""
-    baseline = get_user_behavior_baseline(user_id)
-    bulk_ops = detect_bulk_operations(user_id)
-    violations = check_department_access_violations(user_id)
+    # One connection serves all lookups
+    conn = get_thread_connection()
+    baseline = get_user_behavior_baseline(user_id, conn)
+    bulk_ops = detect_bulk_operations(user_id, conn=conn)
+    violation_count = count_department_access_violations(user_id, conn)
+    # Callers that only need the count can skip fetching the violation rows
+    violations = (list_department_access_violations(user_id, conn=conn)
+                  if include_violations and violation_count else [])
     
     # Calculate overall risk score
     risk_factors = []
@@ -164,9 +215,9 @@ def generate_risk_report(user_id: int) -> Dict:
         risk_factors.extend(bulk_ops['risk_factors'])
         total_risk += bulk_ops['risk_score']
     
-    if violations:
-        risk_factors.append(f"{len(violations)} cross-department access violations")
-        total_risk += len(violations) * 0.2
+    if violation_count:
+        risk_factors.append(f"{violation_count} cross-department access violations")
+        total_risk += violation_count * 0.2
     
     if baseline.get('avg_risk_score', 0) > 0.5:
         risk_factors.append("Consistently high individual risk scores")
@@ -181,6 +232,7 @@ def generate_risk_report(user_id: int) -> Dict:
         'risk_factors': risk_factors,
         'baseline': baseline,
         'bulk_operations': bulk_ops,
+        'department_violation_count': violation_count,
         'department_violations': violations,
         'timestamp': datetime.now(INDIA_TIMEZONE).isoformat() # Use IST
     }
\ No newline at end of file
@@ -1,24 +1,53 @@
 # backend/anomaly/ml_models.py
 
 from sklearn.ensemble import IsolationForest
-from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
+from sklearn.base import clone
+import joblib
+from joblib import parallel_backend
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Tuple
-import pickle
+from typing import List, Dict, Tuple, Optional
 import os
+import threading
+import time
 from datetime import datetime
-import pytz # Import pytz
+from db import timestamp_to_epoch_ns, timestamps_to_epoch_ns, NAT_NS, INDIA_TIMEZONE, IST_OFFSET_SECONDS
 
-INDIA_TIMEZONE = pytz.timezone('Asia/Kolkata') # Define Indian timezone
+# Retrain on fresh access logs at most this often; in between the trained
+# models are reused from memory
+RETRAIN_INTERVAL_SECONDS = 3600
+
+MODELS_DIR = "models"
+MODEL_BUNDLE_PATH = os.path.join(MODELS_DIR, "bundle.joblib")
 
 class AnomalyDetector:
     def __init__(self):
-        self.isolation_forest = IsolationForest(contamination=0.1, random_state=42)
-        self.kmeans = KMeans(n_clusters=3, random_state=42)
+        # n_jobs=-1 builds the trees on all cores; sklearn releases the GIL in
+        # tree code so the threading backend avoids process pickling overhead.
+        # 50 trees on 256-sample subsets (the iForest paper's defaults) is
+        # plenty for ~1000 training logs and halves scoring cost; 'auto' is
+        # min(256, n_samples) without warning on smaller training sets.
+        self.isolation_forest = IsolationForest(n_estimators=50, max_samples='auto',
+                                                contamination=0.1, n_jobs=-1,
+                                                random_state=42)
         self.scaler = StandardScaler()
         self.is_trained = False
+        self.feature_cols_ = []
+        self.action_vocab_ = []
+        # (forest, scaler, feature_cols, feature_index, mean, scale) of the
+        # model in use; scoring reads it once so a retrain swapping in a new
+        # tuple never mixes parts of two models
+        self._model = None
+        self._last_train_ts = 0.0
+        self._bundle_mtime = None
+        # Held by the one thread retraining; others score with the old model
+        self.training_lock = threading.Lock()
+        
+    def needs_training(self) -> bool:
+        """Check if the models are missing or older than the retrain interval"""
+        return (not self.is_trained or
+                time.monotonic() - self._last_train_ts > RETRAIN_INTERVAL_SECONDS)
         
     def prepare_features(self, access_logs: List[Dict]) -> pd.DataFrame:
         """Prepare features for ML models"""
@@ -27,31 +56,22 @@ class AnomalyDetector:
         if df.empty:
             return pd.DataFrame()
         
-        # Convert timestamp to datetime objects, coercing errors to NaT
-        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce', format='mixed')
-
-        # Drop rows where timestamp couldn't be parsed
-        df.dropna(subset=['timestamp'], inplace=True)
-        
-        # Function to convert individual datetime object to IST
-        def convert_to_ist(dt_obj):
-            if dt_obj.tzinfo is None:
-                # If naive, assume UTC and localize, then convert
-                return pytz.utc.localize(dt_obj).astimezone(INDIA_TIMEZONE)
-            else:
-                # If already timezone-aware, just convert
-                return dt_obj.astimezone(INDIA_TIMEZONE)
+        # Parse timestamps straight into int64 UTC epoch nanoseconds,
+        # unparseable values become NaT
+        epoch_ns = timestamps_to_epoch_ns(df['timestamp'])
 
-        # Apply the conversion function to the timestamp series
-        df['timestamp'] = df['timestamp'].apply(convert_to_ist)
+        # Drop rows where timestamp couldn't be parsed and convert the whole
+        # column to IST at once
+        valid = epoch_ns != NAT_NS
+        timestamps = pd.DatetimeIndex(epoch_ns[valid].view('datetime64[ns]')).tz_localize('UTC')
+        df = df[valid].assign(timestamp=timestamps.tz_convert(INDIA_TIMEZONE))
 
         df['hour'] = df['timestamp'].dt.hour
         df['day_of_week'] = df['timestamp'].dt.dayofweek
         
-        # Create binary features for actions
-        actions = df['action'].unique()
-        for action in actions:
-            df[f'action_{action}'] = (df['action'] == action).astype(int)
+        # Create binary features for actions in one vectorized one-hot pass
+        dummies = pd.get_dummies(df['action'], prefix='action', dtype=np.uint8)
+        df = pd.concat([df, dummies], axis=1)
         
         # Department mismatch feature (if available)
         if 'department' in df.columns and 'user_department' in df.columns:
@@ -70,81 +90,192 @@ class AnomalyDetector:
         
         return df[feature_cols].fillna(0) # fillna(0) for any remaining NaNs
     
+    def prepare_feature_matrix(self, log_arrays: Dict) -> Tuple[np.ndarray, List[str]]:
+        """Build the feature matrix straight from get_access_logs(as_arrays=True) output"""
+        valid = log_arrays['ts_ns'] != NAT_NS
+        ist_seconds = log_arrays['ts_ns'][valid] // 1_000_000_000 + IST_OFFSET_SECONDS
+        actions = log_arrays['actions']
+        
+        features = np.column_stack([
+            log_arrays['user_id'][valid],
+            (ist_seconds // 3600) % 24,
+            (ist_seconds // 86400 + 3) % 7, # 1970-01-01 was a Thursday (day 3)
+            log_arrays['dept_mismatch'][valid],
+            np.eye(len(actions))[log_arrays['action_id'][valid]]
+        ]).astype(np.float64, copy=False)
+        
+        # Same column layout as prepare_features (action columns sorted by name)
+        feature_cols = ['user_id', 'hour', 'day_of_week', 'dept_mismatch'] + \
+                       [f'action_{action}' for action in actions]
+        return features, feature_cols
+    
     def train(self, access_logs: List[Dict]):
         """Train anomaly detection models"""
         features_df = self.prepare_features(access_logs)
-        
-        if features_df.empty or len(features_df) < 10:
+        self._fit(features_df.to_numpy(dtype=np.float64), features_df.columns.tolist())
+    
+    def train_from_arrays(self, log_arrays: Dict):
+        """Train anomaly detection models from columnar access log arrays"""
+        features, feature_cols = self.prepare_feature_matrix(log_arrays)
+        self._fit(features, feature_cols)
+    
+    def _fit(self, features: np.ndarray, feature_cols: List[str]):
+        """Fit the scaler and Isolation Forest on a feature matrix"""
+        if len(features) < 10:
             print("Insufficient data for training")
             return
         
-        # Scale features
-        features_scaled = self.scaler.fit_transform(features_df)
+        # Fit fresh instances so requests keep scoring with the current
+        # ones until the new model is swapped in. Scale features on a plain
+        # array so single vectors can be transformed without column names
+        scaler = StandardScaler()
+        features_scaled = scaler.fit_transform(features)
         
-        # Train models
-        self.isolation_forest.fit(features_scaled)
-        self.kmeans.fit(features_scaled)
+        # Train model
+        forest = clone(self.isolation_forest)
+        with parallel_backend("threading", n_jobs=-1):
+            forest.fit(features_scaled)
         
-        self.is_trained = True
+        self._install(forest, scaler, feature_cols)
+        self._last_train_ts = time.monotonic()
         
         # Save models
         self.save_models()
     
+    def _install(self, forest: IsolationForest, scaler: StandardScaler, feature_cols: List[str]):
+        """Swap in a fitted forest, its scaler and training column order as one unit"""
+        # The scaler parameters are kept as float32 arrays for inline scaling
+        # and the column index for the single-record fast path
+        feature_index = {col: i for i, col in enumerate(feature_cols)}
+        self._model = (forest, scaler, feature_cols, feature_index,
+                       scaler.mean_.astype(np.float32), scaler.scale_.astype(np.float32))
+        self.isolation_forest = forest
+        self.scaler = scaler
+        self.feature_cols_ = feature_cols
+        self.action_vocab_ = [col[7:] for col in feature_cols if col.startswith('action_')]
+        self.is_trained = True
+    
+    def _featurize_single(self, access_log: Dict, feature_index: Dict) -> Optional[np.ndarray]:
+        """Build one feature vector in training column order without pandas"""
+        epoch_ns = timestamp_to_epoch_ns(access_log.get('timestamp'))
+        if epoch_ns == NAT_NS:
+            return None
+        local_time = datetime.fromtimestamp(epoch_ns // 1_000_000_000, INDIA_TIMEZONE)
+        
+        index = feature_index
+        vec = np.zeros(len(feature_index), dtype=np.float32)
+        vec[index['user_id']] = access_log.get('user_id') or 0
+        vec[index['hour']] = local_time.hour
+        vec[index['day_of_week']] = local_time.weekday()
+        if 'department' in access_log and 'user_department' in access_log:
+            vec[index['dept_mismatch']] = access_log['department'] != access_log['user_department']
+        
+        # Actions not seen at training time leave every action column at 0
+        action_col = index.get(f"action_{access_log.get('action')}")
+        if action_col is not None:
+            vec[action_col] = 1
+        return vec
+    
+    def _score(self, forest: IsolationForest, features_scaled: np.ndarray) -> List[Tuple[bool, float]]:
+        """Score scaled feature rows with the Isolation Forest"""
+        with parallel_backend("threading", n_jobs=-1):
+            anomaly_scores = forest.decision_function(features_scaled)
+        
+        # predict() is just the sign of decision_function, so one forest pass
+        # gives both outputs
+        is_anomaly = anomaly_scores < 0
+        
+        # Convert anomaly score to risk score (0-1)
+        risk_scores = np.clip(0.5 - anomaly_scores, 0.0, 1.0)
+        return list(zip(is_anomaly.tolist(), risk_scores.tolist()))
+    
     def predict_anomaly(self, access_log: Dict) -> Tuple[bool, float]:
         """Predict if access log is anomalous"""
         if not self.is_trained:
             self.load_models()
-            
-        if not self.is_trained:
+        
+        model = self._model
+        if model is None:
             return False, 0.0
+        forest, _, _, feature_index, mean, scale = model
         
-        # Prepare features
-        features_df = self.prepare_features([access_log])
-        if features_df.empty:
+        vec = self._featurize_single(access_log, feature_index)
+        if vec is None:
             return False, 0.0
         
-        features_scaled = self.scaler.transform(features_df)
+        # Scale inline in float32, the dtype the forest's trees run in, and
+        # skip sklearn's input validation for this one row
+        features_scaled = ((vec - mean) / scale).reshape(1, -1)
+        return self._score(forest, features_scaled)[0]
+    
+    def predict_anomaly_batch(self, access_logs: List[Dict]) -> List[Tuple[bool, float]]:
+        """Predict anomalies for several access logs with a single model pass"""
+        results = [(False, 0.0)] * len(access_logs)
         
-        # Isolation Forest prediction
-        anomaly_score = self.isolation_forest.decision_function(features_scaled)[0]
-        is_anomaly = self.isolation_forest.predict(features_scaled)[0] == -1
+        if not self.is_trained:
+            self.load_models()
+            
+        model = self._model
+        if model is None or not access_logs:
+            return results
+        forest, scaler, feature_cols = model[:3]
         
-        # Convert anomaly score to risk score (0-1)
-        risk_score = max(0, min(1, (0.5 - anomaly_score) / 1.0))
+        # Prepare features, aligned to the columns seen at training time
+        features_df = self.prepare_features(access_logs)
+        if features_df.empty:
+            return results
+        features_df = features_df.reindex(columns=feature_cols, fill_value=0)
+        
+        features_scaled = scaler.transform(features_df.to_numpy(dtype=np.float64))
+        
+        # Rows with unparseable timestamps keep the default result
+        for row, result in zip(features_df.index, self._score(forest, features_scaled)):
+            results[row] = result
         
-        return is_anomaly, risk_score
+        return results
     
     def save_models(self):
-        """Save trained models to disk"""
-        models_dir = "models"
-        os.makedirs(models_dir, exist_ok=True)
+        """Save trained models to disk as a single uncompressed joblib bundle"""
+        os.makedirs(MODELS_DIR, exist_ok=True)
         
-        with open(os.path.join(models_dir, "isolation_forest.pkl"), "wb") as f:
-            pickle.dump(self.isolation_forest, f)
-        
-        with open(os.path.join(models_dir, "kmeans.pkl"), "wb") as f:
-            pickle.dump(self.kmeans, f)
+        # Other detectors may have the current bundle memory-mapped, so the
+        # new one is written beside it and swapped in; overwriting the file
+        # in place would crash them with SIGBUS
+        forest, scaler, feature_cols = self._model[:3]
+        tmp_path = f"{MODEL_BUNDLE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            joblib.dump({
+                'isolation_forest': forest,
+                'scaler': scaler,
+                'feature_cols': feature_cols
+            }, tmp_path, compress=0)
+            os.replace(tmp_path, MODEL_BUNDLE_PATH)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         
-        with open(os.path.join(models_dir, "scaler.pkl"), "wb") as f:
-            pickle.dump(self.scaler, f)
+        self._bundle_mtime = os.stat(MODEL_BUNDLE_PATH).st_mtime_ns
     
     def load_models(self):
-        """Load trained models from disk"""
-        models_dir = "models"
-        
+        """Load trained models from disk, skipped when the bundle is unchanged"""
         try:
-            with open(os.path.join(models_dir, "isolation_forest.pkl"), "rb") as f:
-                self.isolation_forest = pickle.load(f)
-            
-            with open(os.path.join(models_dir, "kmeans.pkl"), "rb") as f:
-                self.kmeans = pickle.load(f)
-            
-            with open(os.path.join(models_dir, "scaler.pkl"), "rb") as f:
-                self.scaler = pickle.load(f)
-            
-            self.is_trained = True
+            mtime = os.stat(MODEL_BUNDLE_PATH).st_mtime_ns
         except FileNotFoundError:
             print("No trained models found")
+            return
+        
+        if self.is_trained and mtime == self._bundle_mtime:
+            return
+        
+        # Uncompressed bundles let joblib memory-map the numpy arrays
+        bundle = joblib.load(MODEL_BUNDLE_PATH, mmap_mode='r')
+        self._install(bundle['isolation_forest'], bundle['scaler'], bundle['feature_cols'])
+        
+        self._bundle_mtime = mtime
+        # The bundle is as old as its file, so a fresh process retrains only
+        # once the saved model is past the retrain interval
+        bundle_age = max(0.0, time.time() - mtime / 1e9)
+        self._last_train_ts = time.monotonic() - bundle_age
 
 # Global anomaly detector instance
 anomaly_detector = AnomalyDetector()
\ No newline at end of file
@@ -1,22 +1,47 @@
 # backend/app.py - COMPLETE FIXED VERSION - All Features Working
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from auth.routes import router as auth_router, get_current_user
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from auth.routes import router as auth_router, require_admin
 from auth.models import User
 from documents.routes import router as docs_router
-from db import execute_db_query, init_database, get_current_ist_timestamp
+from documents.versioning import get_file_diff, MAX_DIFF_CHARS
+from db import execute_db_query, db_connection, init_database, close_db_connection, get_current_ist_timestamp, get_ist_timestamp_ago
+from response_cache import cached_json_response, invalidate_cached_responses
+import anyio
+import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from cachetools import LRUCache
 import os
+import sys
+import threading
 import json
 from datetime import datetime, timedelta
 from typing import Optional
 
-# Initialize database
-init_database()
+# Blocking handlers (def) run on anyio's worker threads; the default 40
+# tokens queue requests long before SQLite or the CPU is saturated
+THREADPOOL_SIZE = 200
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the database and worker threads per process, close the connection on shutdown"""
+    # Runs after uvicorn forks its workers, so each opens its own connection
+    init_database()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+    close_db_connection()
+
+# orjson encodes the dashboard payloads several times faster than stdlib json
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Compress larger JSON and report payloads; added before CORS so it wraps
+# innermost and CORS headers are set on the compressed response
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 # CORS middleware - Allow access from any IP for development
 app.add_middleware(
@@ -27,97 +52,243 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with a Cache-Control header; ETag and 304 handling come from Starlette"""
+    
+    def __init__(self, *args, cache_control: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+    
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
+# Mount static files. Documents can be replaced in place, so browsers
+# revalidate them by ETag; generated reports get a fresh name every time
 os.makedirs("static", exist_ok=True)
 os.makedirs("reports", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/reports", StaticFiles(directory="reports"), name="reports")
+app.mount("/static", CachedStaticFiles(directory="static", cache_control="private, no-cache"),
+          name="static")
+app.mount("/reports", CachedStaticFiles(directory="reports", cache_control="private, max-age=3600"),
+          name="reports")
 
 # Include routers
 app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
 app.include_router(docs_router, prefix="/api/documents", tags=["documents"])
 
+# Page sizes for the alert and access log listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def _keyset_filter(alias, after_ts, after_id):
+    """WHERE clause and params resuming a newest-first listing after a cursor"""
+    if after_ts is None:
+        return "", ()
+    if after_id is None:
+        return f"WHERE {alias}.timestamp < ?", (after_ts,)
+    return f"WHERE ({alias}.timestamp, {alias}.id) < (?, ?)", (after_ts, after_id)
+
+def _next_cursor(rows, limit):
+    """Cursor for the page after rows, or None when this was the last page"""
+    if len(rows) < limit:
+        return None
+    return {"after_ts": rows[-1]['timestamp'], "after_id": rows[-1]['id']}
+
+def _read_text_or_none(path):
+    """Read a text file, returning None when it does not exist"""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _file_version(path):
+    """(mtime_ns, size) of a file, or None when it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _modification_diff_stats(current_file, backup_file):
+    """(added_lines, removed_lines, change_percentage) of a document against its backup"""
+    # Listings repeat the same documents, so stats are cached until either file changes
+    return _diff_stats_for_versions(current_file, _file_version(current_file),
+                                    backup_file, _file_version(backup_file))
+
+@lru_cache(maxsize=256)
+def _diff_stats_for_versions(current_file, current_version, backup_file, backup_version):
+    """Line diff stats for one (current, backup) file version pair"""
+    added_lines = 0
+    removed_lines = 0
+    change_percentage = 0.0
+    
+    # Open the files directly; a missing file costs one failed
+    # open instead of exists() checks on every request
+    new_content = _read_text_or_none(current_file)
+    old_content = _read_text_or_none(backup_file) if new_content is not None else None
+    
+    if old_content is not None:
+        old_content = old_content.strip()
+        new_content = new_content.strip()
+        
+        old_lines = old_content.split('\n') if old_content else []
+        new_lines = new_content.split('\n') if new_content else []
+        
+        # Simple diff calculation
+        old_set = set(old_lines)
+        new_set = set(new_lines)
+        
+        added_lines = len(new_set - old_set)
+        removed_lines = len(old_set - new_set)
+        
+        # Calculate change percentage
+        total_lines = max(len(old_lines), len(new_lines), 1)
+        changed_lines = added_lines + removed_lines
+        change_percentage = (changed_lines / total_lines) * 100
+        
+    elif new_content is not None:
+        # New file upload
+        content = new_content.strip()
+        lines = content.split('\n') if content else []
+        added_lines = len(lines)
+        change_percentage = 100.0  # New file is 100% change
+    
+    return added_lines, removed_lines, change_percentage
+
+# Diff view file contents per (path, mtime, size), bounded by the memory
+# the strings take rather than by entry count
+DIFF_CONTENT_CACHE_BYTES = 8 * 1024 * 1024
+_diff_content_cache = LRUCache(maxsize=DIFF_CONTENT_CACHE_BYTES,
+                               getsizeof=lambda entry: sys.getsizeof(entry[0]))
+_diff_content_cache_lock = threading.Lock()
+
+def _read_capped(path, mtime_ns, size):
+    """Read at most MAX_DIFF_CHARS of a text file; cached per (path, mtime, size)"""
+    key = (path, mtime_ns, size)
+    with _diff_content_cache_lock:
+        entry = _diff_content_cache.get(key)
+    if entry is None:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read(MAX_DIFF_CHARS + 1)
+        entry = (content[:MAX_DIFF_CHARS], len(content) > MAX_DIFF_CHARS)
+        with _diff_content_cache_lock:
+            try:
+                _diff_content_cache[key] = entry
+            except ValueError:
+                pass # larger than the whole cache
+    return entry
+
+def _safe_read(path):
+    """Read at most MAX_DIFF_CHARS of a text file as (content, truncated); content is None if unreadable"""
+    try:
+        # Re-opened diffs are served from memory until the file changes
+        stat = os.stat(path)
+        return _read_capped(path, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None, False
+    except Exception as read_error:
+        print(f"Error reading {path}: {read_error}")
+        return None, False
+
+def _diff_response(old_content, new_content):
+    """Unified diff text of two documents with added/removed line counts"""
+    file_diff = get_file_diff(old_content, new_content)
+    # Diff lines keep their line endings; the response joins them with \n
+    return {
+        "diff": "\n".join(line.rstrip("\r\n") for line in file_diff['diff_lines']),
+        "added_lines": file_diff['added_lines'],
+        "removed_lines": file_diff['removed_lines']
+    }
+
 @app.get("/")
 async def root():
     return {"message": "Enterprise Data Guard API"}
 
 # COMPLETE ADMIN DASHBOARD ENDPOINTS
 @app.get("/api/admin/dashboard")
-async def get_admin_dashboard(current_user: User = Depends(get_current_user)):
+async def get_admin_dashboard(current_user: User = Depends(require_admin)):
     """Get comprehensive admin dashboard data"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
-        # Get recent alerts FROM ACCESS LOGS (authoritative source)
-        alerts = execute_db_query('''
-            SELECT 
-                al.id,
-                al.user_id,
-                al.document_name,
-                al.action as alert_type,
-                al.timestamp,
-                al.risk_score,
-                CASE 
-                    WHEN al.action LIKE '%unauthorized%' THEN 'Unauthorized access attempt detected'
-                    WHEN al.action = 'upload' AND al.risk_score >= 0.7 THEN 'High-risk document upload'
-                    WHEN al.action = 'download' AND al.risk_score >= 0.7 THEN 'Suspicious document download'
-                    ELSE 'Security event detected'
-                END as description,
-                0 as resolved,
-                u.username,
-                u.department
-            FROM access_logs al
-            JOIN users u ON al.user_id = u.id 
-            WHERE al.risk_score >= 0.4 OR al.anomaly_flag = 1
-            ORDER BY al.timestamp DESC 
-            LIMIT 20
-        ''', fetch_all=True)
-        
-        # Get recent access logs
-        access_logs = execute_db_query('''
-            SELECT al.*, u.username, u.department 
-            FROM access_logs al 
-            JOIN users u ON al.user_id = u.id 
-            ORDER BY al.timestamp DESC 
-            LIMIT 30
-        ''', fetch_all=True)
-        
-        # Calculate summary statistics
-        total_alerts = len(alerts) if alerts else 0
-        high_risk_alerts = len([a for a in (alerts or []) if a['risk_score'] >= 0.7])
-        recent_access = len(access_logs) if access_logs else 0
-        anomalous_activities = len([l for l in (access_logs or []) if l['anomaly_flag']])
-        
-        # Get document stats for overview
-        doc_stats = execute_db_query('''
-            SELECT department, COUNT(*) as count 
-            FROM documents 
-            GROUP BY department
-        ''', fetch_all=True)
-        
-        # Get user stats
-        user_stats = execute_db_query('''
-            SELECT department, COUNT(*) as count 
-            FROM users 
-            WHERE role != 'admin' 
-            GROUP BY department
-        ''', fetch_all=True)
-        
-        return {
-            "alerts": alerts or [],
-            "recent_access": access_logs or [],
-            "document_stats": doc_stats or [],
-            "user_stats": user_stats or [],
-            "summary": {
-                "total_alerts": total_alerts,
-                "high_risk_alerts": high_risk_alerts,
-                "recent_access": recent_access,
-                "anomalous_activities": anomalous_activities,
-                "total_documents": sum(stat['count'] for stat in (doc_stats or [])),
-                "total_users": sum(stat['count'] for stat in (user_stats or []))
+        def build_dashboard():
+            # One connection for the whole query set
+            with db_connection() as conn:
+                # Get recent alerts FROM ACCESS LOGS (authoritative source)
+                alerts = execute_db_query('''
+                    SELECT 
+                        al.id,
+                        al.user_id,
+                        al.document_name,
+                        al.action as alert_type,
+                        al.timestamp,
+                        al.risk_score,
+                        CASE 
+                            WHEN al.action LIKE '%unauthorized%' THEN 'Unauthorized access attempt detected'
+                            WHEN al.action = 'upload' AND al.risk_score >= 0.7 THEN 'High-risk document upload'
+                            WHEN al.action = 'download' AND al.risk_score >= 0.7 THEN 'Suspicious document download'
+                            ELSE 'Security event detected'
+                        END as description,
+                        0 as resolved,
+                        u.username,
+                        u.department
+                    FROM access_logs al
+                    JOIN users u ON al.user_id = u.id 
+                    WHERE al.risk_score >= 0.4 OR al.anomaly_flag = 1
+                    ORDER BY al.timestamp DESC 
+                    LIMIT 20
+                ''', fetch_all=True, conn=conn)
+        
+                # Get recent access logs, only the columns the dashboard shows
+                access_logs = execute_db_query('''
+                    SELECT al.id, al.document_name, al.action, al.timestamp,
+                           al.anomaly_flag, al.risk_score, u.username, u.department 
+                    FROM access_logs al 
+                    JOIN users u ON al.user_id = u.id 
+                    ORDER BY al.timestamp DESC 
+                    LIMIT 30
+                ''', fetch_all=True, conn=conn)
+        
+                # Summary counts over all access logs, the alert criteria match
+                # the alerts query above; document and user totals ride along
+                summary = execute_db_query('''
+                    SELECT 
+                        COALESCE(SUM(risk_score >= 0.4 OR anomaly_flag = 1), 0) as total_alerts,
+                        COALESCE(SUM(risk_score >= 0.7), 0) as high_risk_alerts,
+                        COUNT(*) as recent_access,
+                        COALESCE(SUM(anomaly_flag = 1), 0) as anomalous_activities,
+                        (SELECT COUNT(*) FROM documents) as total_documents,
+                        (SELECT COUNT(*) FROM users WHERE role != 'admin') as total_users
+                    FROM access_logs
+                ''', fetch_one=True, conn=conn)
+        
+                # Document and user stats per department in one query, split
+                # by the kind column
+                dept_stats = execute_db_query('''
+                    SELECT 'document' as kind, department, COUNT(*) as count 
+                    FROM documents 
+                    GROUP BY department
+                    UNION ALL
+                    SELECT 'user' as kind, department, COUNT(*) as count 
+                    FROM users 
+                    WHERE role != 'admin' 
+                    GROUP BY department
+                ''', fetch_all=True, conn=conn) or []
+            
+            doc_stats, user_stats = [], []
+            for stat in dept_stats:
+                kind = stat.pop('kind')
+                (doc_stats if kind == 'document' else user_stats).append(stat)
+            
+            return {
+                "alerts": alerts or [],
+                "recent_access": access_logs or [],
+                "document_stats": doc_stats,
+                "user_stats": user_stats,
+                "summary": summary
             }
-        }
+        
+        return await cached_json_response("dashboard", build_dashboard)
         
     except Exception as e:
         print(f"Dashboard error: {e}")
@@ -137,168 +308,136 @@ async def get_admin_dashboard(current_user: User = Depends(get_current_user)):
         }
 
 @app.get("/api/admin/modifications")
-async def get_document_modifications(current_user: User = Depends(get_current_user)):
+async def get_document_modifications(current_user: User = Depends(require_admin)):
     """Get document modifications for admin dashboard"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
-        # Get from access logs where action indicates modification
-        raw_modifications = execute_db_query('''
-            SELECT 
-                al.id,
-                al.user_id,
-                al.doc_id,
-                al.document_name,
-                al.action as modification_type,
-                al.timestamp,
-                al.risk_score,
-                u.username,
-                u.department
-            FROM access_logs al
-            JOIN users u ON al.user_id = u.id
-            WHERE al.action IN ('upload', 'update', 'modify')
-            ORDER BY al.timestamp DESC
-            LIMIT 50
-        ''', fetch_all=True)
-        
-        modifications = []
-        
-        # Calculate real diff stats for each modification
-        for mod in (raw_modifications or []):
-            try:
-                # Try to find the document and calculate real diff stats
-                doc_name = mod['document_name']
-                dept = mod['department']
-                
-                # Construct file paths
-                current_file = f"static/docs/{dept}/{doc_name}"
-                backup_file = f"{current_file}.backup"
+        def build_modifications():
+            # Get from access logs where action indicates modification
+            raw_modifications = execute_db_query('''
+                SELECT 
+                    al.id,
+                    al.user_id,
+                    al.doc_id,
+                    al.document_name,
+                    al.action as modification_type,
+                    al.timestamp,
+                    al.risk_score,
+                    u.username,
+                    u.department
+                FROM access_logs al
+                JOIN users u ON al.user_id = u.id
+                WHERE al.action IN ('upload', 'update', 'modify')
+                ORDER BY al.timestamp DESC
+                LIMIT 50
+            ''', fetch_all=True)
+        
+            modifications = []
+        
+            # Calculate real diff stats for each modification
+            for mod in (raw_modifications or []):
+                try:
+                    # Try to find the document and calculate real diff stats
+                    doc_name = mod['document_name']
+                    dept = mod['department']
                 
-                # Default stats
-                added_lines = 0
-                removed_lines = 0
-                change_percentage = 0.0
+                    # Construct file paths
+                    current_file = f"static/docs/{dept}/{doc_name}"
+                    backup_file = f"{current_file}.backup"
                 
-                # Try to calculate real diff stats
-                try:
-                    if os.path.exists(backup_file) and os.path.exists(current_file):
-                        with open(backup_file, 'r', encoding='utf-8', errors='ignore') as f:
-                            old_content = f.read().strip()
-                        with open(current_file, 'r', encoding='utf-8', errors='ignore') as f:
-                            new_content = f.read().strip()
-                        
-                        old_lines = old_content.split('\n') if old_content else []
-                        new_lines = new_content.split('\n') if new_content else []
-                        
-                        # Simple diff calculation
-                        old_set = set(old_lines)
-                        new_set = set(new_lines)
-                        
-                        added_lines = len(new_set - old_set)
-                        removed_lines = len(old_set - new_set)
+                    # Try to calculate real diff stats
+                    try:
+                        added_lines, removed_lines, change_percentage = \
+                            _modification_diff_stats(current_file, backup_file)
                         
-                        # Calculate change percentage
-                        total_lines = max(len(old_lines), len(new_lines), 1)
-                        changed_lines = added_lines + removed_lines
-                        change_percentage = (changed_lines / total_lines) * 100
-                        
-                    elif os.path.exists(current_file):
-                        # New file upload
-                        with open(current_file, 'r', encoding='utf-8', errors='ignore') as f:
-                            content = f.read().strip()
-                        lines = content.split('\n') if content else []
-                        added_lines = len(lines)
-                        change_percentage = 100.0  # New file is 100% change
-                        
-                except Exception as file_error:
-                    print(f"Error calculating diff for {doc_name}: {file_error}")
-                    # Use some reasonable defaults based on risk score
-                    if mod['risk_score'] >= 0.7:
-                        added_lines = 12
-                        removed_lines = 8
-                        change_percentage = 35.2
-                    elif mod['risk_score'] >= 0.4:
-                        added_lines = 6
-                        removed_lines = 3
-                        change_percentage = 18.7
-                    else:
-                        added_lines = 2
-                        removed_lines = 1
-                        change_percentage = 8.5
+                    except Exception as file_error:
+                        print(f"Error calculating diff for {doc_name}: {file_error}")
+                        # Use some reasonable defaults based on risk score
+                        if mod['risk_score'] >= 0.7:
+                            added_lines = 12
+                            removed_lines = 8
+                            change_percentage = 35.2
+                        elif mod['risk_score'] >= 0.4:
+                            added_lines = 6
+                            removed_lines = 3
+                            change_percentage = 18.7
+                        else:
+                            added_lines = 2
+                            removed_lines = 1
+                            change_percentage = 8.5
                 
-                # Create diff stats JSON
-                diff_stats = json.dumps({
-                    "added_lines": added_lines,
-                    "removed_lines": removed_lines,
-                    "change_percentage": round(change_percentage, 1)
-                })
+                    # Create diff stats JSON
+                    diff_stats = json.dumps({
+                        "added_lines": added_lines,
+                        "removed_lines": removed_lines,
+                        "change_percentage": round(change_percentage, 1)
+                    })
                 
-                # Add diff_stats to the modification record
-                mod_with_stats = dict(mod)
-                mod_with_stats['diff_stats'] = diff_stats
-                modifications.append(mod_with_stats)
+                    # Add diff_stats to the modification record
+                    mod_with_stats = dict(mod)
+                    mod_with_stats['diff_stats'] = diff_stats
+                    modifications.append(mod_with_stats)
                 
-            except Exception as mod_error:
-                print(f"Error processing modification {mod['id']}: {mod_error}")
-                # Add with default stats
-                mod_with_stats = dict(mod)
-                mod_with_stats['diff_stats'] = json.dumps({
-                    "added_lines": 1,
-                    "removed_lines": 0,
-                    "change_percentage": 5.0
-                })
-                modifications.append(mod_with_stats)
-        
-        return {"modifications": modifications}
+                except Exception as mod_error:
+                    print(f"Error processing modification {mod['id']}: {mod_error}")
+                    # Add with default stats
+                    mod_with_stats = dict(mod)
+                    mod_with_stats['diff_stats'] = json.dumps({
+                        "added_lines": 1,
+                        "removed_lines": 0,
+                        "change_percentage": 5.0
+                    })
+                    modifications.append(mod_with_stats)
+        
+            return {"modifications": modifications}
+        
+        return await cached_json_response("modifications", build_modifications)
         
     except Exception as e:
         print(f"Modifications error: {e}")
         return {"modifications": []}
 
 @app.get("/api/admin/data-leaks")
-async def get_data_leak_attempts(current_user: User = Depends(get_current_user)):
+async def get_data_leak_attempts(current_user: User = Depends(require_admin)):
     """Get data leak attempts for admin analysis"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
-        # Get cross-department access attempts and unauthorized access
-        attempts = execute_db_query('''
-            SELECT 
-                al.id,
-                al.user_id,
-                u.username,
-                u.department as user_department,
-                al.document_name,
-                'Finance' as target_department,
-                al.action as action_attempted,
-                al.risk_score,
-                al.timestamp,
-                CASE WHEN al.risk_score >= 0.7 THEN 1 ELSE 0 END as blocked
-            FROM access_logs al
-            JOIN users u ON al.user_id = u.id
-            WHERE al.action LIKE '%unauthorized%' OR al.risk_score >= 0.5
-            ORDER BY al.timestamp DESC
-            LIMIT 30
-        ''', fetch_all=True)
-        
-        return {"attempts": attempts or []}
+        def build_attempts():
+            # Get cross-department access attempts and unauthorized access
+            attempts = execute_db_query('''
+                SELECT 
+                    al.id,
+                    al.user_id,
+                    u.username,
+                    u.department as user_department,
+                    al.document_name,
+                    'Finance' as target_department,
+                    al.action as action_attempted,
+                    al.risk_score,
+                    al.timestamp,
+                    CASE WHEN al.risk_score >= 0.7 THEN 1 ELSE 0 END as blocked
+                FROM access_logs al
+                JOIN users u ON al.user_id = u.id
+                WHERE al.action LIKE '%unauthorized%' OR al.risk_score >= 0.5
+                ORDER BY al.timestamp DESC
+                LIMIT 30
+            ''', fetch_all=True)
+        
+            return {"attempts": attempts or []}
+        
+        return await cached_json_response("data_leaks", build_attempts)
         
     except Exception as e:
         print(f"Data leaks error: {e}")
         return {"attempts": []}
 
 @app.get("/api/admin/modification-diff/{modification_id}")
-async def get_modification_diff(modification_id: int, current_user: User = Depends(get_current_user)):
-    """Get detailed diff for a document modification"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def get_modification_diff(modification_id: int, unified: bool = False,
+                                current_user: User = Depends(require_admin)):
+    """Get detailed diff for a document modification, optionally as a server-side unified diff"""
     try:
         # Get the access log entry
-        log_entry = execute_db_query(
-            "SELECT * FROM access_logs WHERE id = ?", 
+        log_entry = await asyncio.to_thread(
+            execute_db_query,
+            "SELECT document_name, timestamp, user_department, document_department FROM access_logs WHERE id = ?", 
             (modification_id,), fetch_one=True
         )
         
@@ -313,35 +452,38 @@ async def get_modification_diff(modification_id: int, current_user: User = Depen
         current_file = f"static/docs/{dept}/{doc_name}"
         backup_file = f"{current_file}.backup"
         
-        old_content = "Original content not available"
-        new_content = "Modified content not available"
-        
-        # Try to read backup (original) and current (modified) files
-        try:
-            if os.path.exists(backup_file):
-                with open(backup_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    old_content = f.read()
-            elif os.path.exists(current_file):
-                # If no backup, show current as both (no diff)
-                with open(current_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                old_content = content
-                new_content = content
-        except Exception as read_error:
-            print(f"Error reading files: {read_error}")
-        
-        try:
-            if os.path.exists(current_file):
-                with open(current_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    new_content = f.read()
-        except Exception as read_error:
-            print(f"Error reading current file: {read_error}")
+        # Read both files concurrently on worker threads; a missing backup
+        # shows the current file as both sides (no diff)
+        (old_content, old_truncated), (new_content, new_truncated) = await asyncio.gather(
+            asyncio.to_thread(_safe_read, backup_file),
+            asyncio.to_thread(_safe_read, current_file)
+        )
+        if old_content is None:
+            old_content, old_truncated = new_content, new_truncated
+        
+        if old_content is None:
+            old_content = "Original content not available"
+        if new_content is None:
+            new_content = "Modified content not available"
+        
+        # Unified mode ships only the changed hunks instead of both bodies
+        if unified:
+            diff = await asyncio.to_thread(_diff_response, old_content, new_content)
+            return {
+                **diff,
+                "old_size": len(old_content),
+                "new_size": len(new_content),
+                "document_name": doc_name,
+                "modification_time": log_entry['timestamp'],
+                "truncated": old_truncated or new_truncated
+            }
         
         return {
             "old_content": old_content,
             "new_content": new_content,
             "document_name": doc_name,
-            "modification_time": log_entry['timestamp']
+            "modification_time": log_entry['timestamp'],
+            "truncated": old_truncated or new_truncated
         }
         
     except HTTPException:
@@ -351,46 +493,47 @@ async def get_modification_diff(modification_id: int, current_user: User = Depen
         raise HTTPException(status_code=500, detail="Failed to get modification details")
 
 @app.get("/api/admin/alerts")
-async def get_alerts(current_user: User = Depends(get_current_user)):
-    """Get all alerts"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def get_alerts(after_ts: Optional[str] = None, after_id: Optional[int] = None,
+                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     current_user: User = Depends(require_admin)):
+    """Get alerts newest first, one page at a time"""
     try:
-        alerts = execute_db_query('''
-            SELECT a.*, u.username, u.department 
-            FROM alerts a 
-            JOIN users u ON a.user_id = u.id 
-            ORDER BY a.timestamp DESC
-        ''', fetch_all=True)
-        
-        return {"alerts": alerts or []}
+        def build_alerts():
+            where, params = _keyset_filter("a", after_ts, after_id)
+            alerts = execute_db_query(f'''
+                SELECT a.id, a.user_id, a.document_name, a.alert_type, a.description,
+                       a.risk_score, a.timestamp, a.resolved, a.severity,
+                       u.username, u.department 
+                FROM alerts a 
+                JOIN users u ON a.user_id = u.id 
+                {where}
+                ORDER BY a.timestamp DESC, a.id DESC
+                LIMIT ?
+            ''', params + (limit,), fetch_all=True) or []
+            return {"alerts": alerts, "next_cursor": _next_cursor(alerts, limit)}
+        
+        return await cached_json_response(("alerts", after_ts, after_id, limit), build_alerts)
     except Exception as e:
         print(f"Alerts error: {e}")
-        return {"alerts": []}
+        return {"alerts": [], "next_cursor": None}
 
 @app.post("/api/admin/alerts/{alert_id}/resolve")
-async def resolve_alert(alert_id: int, current_user: User = Depends(get_current_user)):
+def resolve_alert(alert_id: int, current_user: User = Depends(require_admin)):
     """Resolve an alert"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
         execute_db_query(
             "UPDATE alerts SET resolved = 1 WHERE id = ?", 
             (alert_id,)
         )
+        invalidate_cached_responses()
         return {"message": "Alert resolved"}
     except Exception as e:
         print(f"Resolve alert error: {e}")
         raise HTTPException(status_code=500, detail="Failed to resolve alert")
 
 @app.post("/api/admin/access-logs/{log_id}/resolve")
-async def resolve_access_log_alert(log_id: int, current_user: User = Depends(get_current_user)):
+def resolve_access_log_alert(log_id: int, current_user: User = Depends(require_admin)):
     """Resolve an alert based on access log entry"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
         # Add a "resolved" field to the access log or create a resolved alerts table
         # For now, we'll reduce the risk score to indicate it's been reviewed
@@ -398,62 +541,223 @@ async def resolve_access_log_alert(log_id: int, current_user: User = Depends(get
             "UPDATE access_logs SET risk_score = risk_score * 0.1 WHERE id = ?", 
             (log_id,)
         )
+        invalidate_cached_responses()
         return {"message": "Alert resolved successfully"}
     except Exception as e:
         print(f"Resolve access log alert error: {e}")
         raise HTTPException(status_code=500, detail="Failed to resolve alert")
 
 @app.get("/api/admin/access-logs")
-async def get_access_logs(current_user: User = Depends(get_current_user)):
-    """Get access logs"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def get_access_logs(after_ts: Optional[str] = None, after_id: Optional[int] = None,
+                          limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          current_user: User = Depends(require_admin)):
+    """Get access logs newest first, one page at a time"""
     try:
-        logs = execute_db_query('''
-            SELECT al.*, u.username, u.department
-            FROM access_logs al 
-            JOIN users u ON al.user_id = u.id 
-            ORDER BY al.timestamp DESC 
-            LIMIT 100
-        ''', fetch_all=True)
-        
-        return {"logs": logs or []}
+        def build_logs():
+            where, params = _keyset_filter("al", after_ts, after_id)
+            logs = execute_db_query(f'''
+                SELECT al.id, al.user_id, al.doc_id, al.document_name, al.action, al.timestamp,
+                       al.anomaly_flag, al.risk_score, al.user_department, al.document_department,
+                       u.username, u.department
+                FROM access_logs al 
+                JOIN users u ON al.user_id = u.id 
+                {where}
+                ORDER BY al.timestamp DESC, al.id DESC 
+                LIMIT ?
+            ''', params + (limit,), fetch_all=True) or []
+            return {"logs": logs, "next_cursor": _next_cursor(logs, limit)}
+        
+        return await cached_json_response(("access_logs", after_ts, after_id, limit), build_logs)
     except Exception as e:
         print(f"Access logs error: {e}")
-        return {"logs": []}
+        return {"logs": [], "next_cursor": None}
 
-@app.get("/api/admin/reports/generate")
-async def generate_report(days: int = 7, format: str = "txt", current_user: User = Depends(get_current_user)):
-    """Generate comprehensive security report in text or PDF format"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
+# Fixed report text, formatted per row instead of assembled line by line
+REPORT_RULE = "=" * 70 + "\n"
+REPORT_SECTION_RULE = "-" * 30 + "\n"
+REPORT_ALERT_ENTRY = (
+    "[{timestamp}] {alert_type}\n"
+    "  User: {username} ({department})\n"
+    "  Document: {document_name}\n"
+    "  Risk Score: {risk_score:.2f}\n"
+    "  Description: {description}\n"
+    "  Status: {status}\n\n"
+)
+REPORT_ANOMALY_ENTRY = (
+    "  [{timestamp}] {username} - {action}\n"
+    "    Document: {document_name}\n"
+    "    Risk Score: {risk_score:.2f}\n\n"
+)
+REPORT_URGENT_RECOMMENDATION = (
+    "1. URGENT: Address critical security alerts immediately\n"
+    "   - Review and resolve all high-risk alerts\n"
+    "   - Implement additional access controls\n\n"
+)
+REPORT_ANOMALY_RECOMMENDATION = (
+    "2. HIGH: High anomaly rate detected\n"
+    "   - Review anomaly detection thresholds\n"
+    "   - Investigate unusual access patterns\n\n"
+)
+REPORT_VOLUME_RECOMMENDATION = (
+    "3. MEDIUM: High alert volume\n"
+    "   - Review security policies\n"
+    "   - Consider additional training\n\n"
+)
+REPORT_GENERAL_RECOMMENDATION = (
+    "4. GENERAL: Continue regular monitoring\n"
+    "   - Maintain current security posture\n"
+    "   - Schedule periodic security reviews\n\n"
+)
+
+def _build_security_report(days):
+    """Query the report period and format the text security report as a list of chunks"""
+    # Get data for the report period. Timestamps are stored as IST
+    # 'YYYY-MM-DD HH:MM:SS' text, so comparing the bare column against a
+    # cutoff in the same format keeps the timestamp indexes usable. Only the
+    # 20 alerts the report lists are fetched
+    period = (get_ist_timestamp_ago(days=days),)
+    alerts = execute_db_query('''
+        SELECT a.timestamp, a.alert_type, a.document_name, a.description,
+               a.risk_score, a.resolved, u.username, u.department
+        FROM alerts a 
+        JOIN users u ON a.user_id = u.id 
+        WHERE a.timestamp >= ?
+        ORDER BY a.timestamp DESC 
+        LIMIT 20
+    ''', period, fetch_all_raw=True)
+    
+    # Summary counts come straight from SQL instead of counting fetched rows
+    summary = execute_db_query('''
+        SELECT 
+            COUNT(*) as total_alerts,
+            COALESCE(SUM(risk_score >= 0.7), 0) as high_risk_alerts,
+            (SELECT COUNT(*) FROM access_logs WHERE timestamp >= ?1) as total_access,
+            (SELECT COUNT(*) FROM access_logs
+             WHERE anomaly_flag = 1 AND timestamp >= ?1) as anomalous
+        FROM alerts
+        WHERE timestamp >= ?1
+    ''', period, fetch_one=True)
+    
+    # Department totals and the latest anomalies are aggregated in SQL. Rows
+    # are only read by name while formatting, so they stay sqlite3.Row
+    dept_activity = execute_db_query('''
+        SELECT u.department, COUNT(*) as count
+        FROM access_logs al
+        JOIN users u ON al.user_id = u.id
+        WHERE al.timestamp >= ?
+        GROUP BY u.department
+        ORDER BY count DESC, u.department
+    ''', period, fetch_all_raw=True)
+    
+    anomalous_logs = execute_db_query('''
+        SELECT al.timestamp, al.action, al.document_name, al.risk_score, u.username
+        FROM access_logs al
+        JOIN users u ON al.user_id = u.id
+        WHERE al.anomaly_flag = 1 AND al.timestamp >= ?
+        ORDER BY al.timestamp DESC
+        LIMIT 10
+    ''', period, fetch_all_raw=True)
+    
+    # Build the report in memory; callers write or stream it in one go
+    parts = []
+    parts.append("🛡️ ENTERPRISE DATA GUARD - COMPREHENSIVE SECURITY REPORT\n")
+    parts.append(REPORT_RULE)
+    parts.append(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    parts.append(f"Report Period: Last {days} days\n")
+    parts.append(f"Classification: CONFIDENTIAL\n\n")
+    
+    # Executive Summary
+    parts.append("📊 EXECUTIVE SUMMARY\n")
+    parts.append(REPORT_SECTION_RULE)
+    total_alerts = summary['total_alerts']
+    high_risk_alerts = summary['high_risk_alerts']
+    total_access = summary['total_access']
+    anomalous = summary['anomalous']
     
+    parts.append(f"• Total Security Alerts: {total_alerts}\n")
+    parts.append(f"• High Risk Alerts: {high_risk_alerts}\n")
+    parts.append(f"• Total Access Events: {total_access}\n")
+    parts.append(f"• Anomalous Activities: {anomalous}\n")
+    parts.append(f"• Overall Risk Level: {'HIGH' if high_risk_alerts > 5 else 'MEDIUM' if total_alerts > 10 else 'LOW'}\n\n")
+    
+    # Security Alerts Section
+    parts.append("🚨 SECURITY ALERTS ANALYSIS\n")
+    parts.append(REPORT_SECTION_RULE)
+    if alerts:
+        for alert in alerts:  # Top 20 alerts
+            parts.append(REPORT_ALERT_ENTRY.format(
+                timestamp=alert['timestamp'],
+                alert_type=alert['alert_type'].upper(),
+                username=alert['username'],
+                department=alert['department'],
+                document_name=alert['document_name'] or 'N/A',
+                risk_score=alert['risk_score'],
+                description=alert['description'],
+                status='RESOLVED' if alert['resolved'] else 'ACTIVE'
+            ))
+    else:
+        parts.append("✅ No security alerts in the reporting period.\n\n")
+    
+    # Access Logs Analysis
+    parts.append("📈 ACCESS ACTIVITY ANALYSIS\n")
+    parts.append(REPORT_SECTION_RULE)
+    if total_access:
+        # Department activity summary
+        parts.append("Department Activity Summary:\n")
+        for stat in dept_activity:
+            parts.append(f"  {stat['department']}: {stat['count']} activities\n")
+        parts.append("\n")
+        
+        # Recent anomalous activities
+        if anomalous_logs:
+            parts.append("Recent Anomalous Activities:\n")
+            for log in anomalous_logs:
+                parts.append(REPORT_ANOMALY_ENTRY.format(
+                    timestamp=log['timestamp'],
+                    username=log['username'],
+                    action=log['action'],
+                    document_name=log['document_name'] or 'N/A',
+                    risk_score=log['risk_score']
+                ))
+    else:
+        parts.append("No access activities recorded.\n\n")
+    
+    # Recommendations
+    parts.append("📋 SECURITY RECOMMENDATIONS\n")
+    parts.append(REPORT_SECTION_RULE)
+    if high_risk_alerts > 5:
+        parts.append(REPORT_URGENT_RECOMMENDATION)
+    
+    if anomalous > total_access * 0.1:
+        parts.append(REPORT_ANOMALY_RECOMMENDATION)
+    
+    if total_alerts > 20:
+        parts.append(REPORT_VOLUME_RECOMMENDATION)
+    
+    parts.append(REPORT_GENERAL_RECOMMENDATION)
+    
+    parts.append(REPORT_RULE)
+    parts.append("End of Report\n")
+    
+    return parts
+
+def _write_security_report(days, report_path):
+    """Build the text security report and save it to report_path"""
+    parts = _build_security_report(days)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write("".join(parts))
+
+@app.get("/api/admin/reports/generate")
+async def generate_report(days: int = 7, format: str = "txt", stream: bool = False,
+                          current_user: User = Depends(require_admin)):
+    """Generate comprehensive security report in text or PDF format, or stream the text report"""
     try:
-        from datetime import datetime
-        
-        # Get data for report
-        alerts = execute_db_query('''
-            SELECT a.*, u.username, u.department
-            FROM alerts a 
-            JOIN users u ON a.user_id = u.id 
-            ORDER BY a.timestamp DESC 
-            LIMIT 100
-        ''', fetch_all=True)
-        
-        access_logs = execute_db_query('''
-            SELECT al.*, u.username, u.department
-            FROM access_logs al 
-            JOIN users u ON al.user_id = u.id 
-            ORDER BY al.timestamp DESC 
-            LIMIT 200
-        ''', fetch_all=True)
-        
         # Generate PDF report if requested
-        if format.lower() == "pdf":
+        if format.lower() == "pdf" and not stream:
             from reports.report_generator import pdf_generator
             try:
-                pdf_path = pdf_generator.generate_comprehensive_security_report(days)
+                # PDF rendering is CPU-bound; keep it off the event loop
+                pdf_path = await asyncio.to_thread(pdf_generator.generate_comprehensive_security_report, days)
                 filename = os.path.basename(pdf_path)
                 return {
                     "message": "PDF security report generated successfully",
@@ -471,91 +775,15 @@ async def generate_report(days: int = 7, format: str = "txt", current_user: User
         report_filename = f"comprehensive_security_report_{timestamp}.txt"
         report_path = f"reports/{report_filename}"
         
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write("🛡️ ENTERPRISE DATA GUARD - COMPREHENSIVE SECURITY REPORT\n")
-            f.write("=" * 70 + "\n")
-            f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Report Period: Last {days} days\n")
-            f.write(f"Classification: CONFIDENTIAL\n\n")
-            
-            # Executive Summary
-            f.write("📊 EXECUTIVE SUMMARY\n")
-            f.write("-" * 30 + "\n")
-            total_alerts = len(alerts or [])
-            high_risk_alerts = len([a for a in (alerts or []) if a['risk_score'] >= 0.7])
-            total_access = len(access_logs or [])
-            anomalous = len([l for l in (access_logs or []) if l['anomaly_flag']])
-            
-            f.write(f"• Total Security Alerts: {total_alerts}\n")
-            f.write(f"• High Risk Alerts: {high_risk_alerts}\n")
-            f.write(f"• Total Access Events: {total_access}\n")
-            f.write(f"• Anomalous Activities: {anomalous}\n")
-            f.write(f"• Overall Risk Level: {'HIGH' if high_risk_alerts > 5 else 'MEDIUM' if total_alerts > 10 else 'LOW'}\n\n")
-            
-            # Security Alerts Section
-            f.write("🚨 SECURITY ALERTS ANALYSIS\n")
-            f.write("-" * 30 + "\n")
-            if alerts:
-                for alert in alerts[:20]:  # Top 20 alerts
-                    f.write(f"[{alert['timestamp']}] {alert['alert_type'].upper()}\n")
-                    f.write(f"  User: {alert['username']} ({alert['department']})\n")
-                    f.write(f"  Document: {alert['document_name'] or 'N/A'}\n")
-                    f.write(f"  Risk Score: {alert['risk_score']:.2f}\n")
-                    f.write(f"  Description: {alert['description']}\n")
-                    f.write(f"  Status: {'RESOLVED' if alert['resolved'] else 'ACTIVE'}\n\n")
-            else:
-                f.write("✅ No security alerts in the reporting period.\n\n")
-            
-            # Access Logs Analysis
-            f.write("📈 ACCESS ACTIVITY ANALYSIS\n")
-            f.write("-" * 30 + "\n")
-            if access_logs:
-                # Department activity summary
-                dept_activity = {}
-                for log in access_logs:
-                    dept = log['department']
-                    dept_activity[dept] = dept_activity.get(dept, 0) + 1
-                
-                f.write("Department Activity Summary:\n")
-                for dept, count in sorted(dept_activity.items(), key=lambda x: x[1], reverse=True):
-                    f.write(f"  {dept}: {count} activities\n")
-                f.write("\n")
-                
-                # Recent anomalous activities
-                anomalous_logs = [l for l in access_logs if l['anomaly_flag']][:10]
-                if anomalous_logs:
-                    f.write("Recent Anomalous Activities:\n")
-                    for log in anomalous_logs:
-                        f.write(f"  [{log['timestamp']}] {log['username']} - {log['action']}\n")
-                        f.write(f"    Document: {log['document_name'] or 'N/A'}\n")
-                        f.write(f"    Risk Score: {log['risk_score']:.2f}\n\n")
-            else:
-                f.write("No access activities recorded.\n\n")
-            
-            # Recommendations
-            f.write("📋 SECURITY RECOMMENDATIONS\n")
-            f.write("-" * 30 + "\n")
-            if high_risk_alerts > 5:
-                f.write("1. URGENT: Address critical security alerts immediately\n")
-                f.write("   - Review and resolve all high-risk alerts\n")
-                f.write("   - Implement additional access controls\n\n")
-            
-            if anomalous > total_access * 0.1:
-                f.write("2. HIGH: High anomaly rate detected\n")
-                f.write("   - Review anomaly detection thresholds\n")
-                f.write("   - Investigate unusual access patterns\n\n")
-            
-            if total_alerts > 20:
-                f.write("3. MEDIUM: High alert volume\n")
-                f.write("   - Review security policies\n")
-                f.write("   - Consider additional training\n\n")
-            
-            f.write("4. GENERAL: Continue regular monitoring\n")
-            f.write("   - Maintain current security posture\n")
-            f.write("   - Schedule periodic security reviews\n\n")
-            
-            f.write("=" * 70 + "\n")
-            f.write("End of Report\n")
+        # sqlite3 queries, formatting and the file write block, so they run
+        # on a worker thread
+        if stream:
+            # Send the report straight to the client without saving it under reports/
+            parts = await asyncio.to_thread(_build_security_report, days)
+            return StreamingResponse(iter(parts), media_type="text/plain",
+                                     headers={"Content-Disposition": f'attachment; filename="{report_filename}"'})
+        
+        await asyncio.to_thread(_write_security_report, days, report_path)
         
         return {
             "message": "Comprehensive security report generated successfully",
@@ -568,52 +796,42 @@ async def generate_report(days: int = 7, format: str = "txt", current_user: User
         raise HTTPException(status_code=500, detail="Failed to generate report")
 
 @app.get("/api/admin/system-health")
-async def get_system_health(current_user: User = Depends(get_current_user)):
+async def get_system_health(current_user: User = Depends(require_admin)):
     """Get system health metrics"""
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
-        # Get health metrics
-        alerts_count = execute_db_query(
-            "SELECT COUNT(*) as count FROM alerts WHERE resolved = 0", 
-            fetch_one=True
-        )
-        
-        critical_alerts = execute_db_query(
-            "SELECT COUNT(*) as count FROM alerts WHERE resolved = 0 AND risk_score >= 0.8", 
-            fetch_one=True
-        )
-        
-        recent_access = execute_db_query(
-            "SELECT COUNT(*) as count FROM access_logs WHERE datetime(timestamp) >= datetime('now', '-24 hours')", 
-            fetch_one=True
-        )
-        
-        anomalies = execute_db_query(
-            "SELECT COUNT(*) as count FROM access_logs WHERE anomaly_flag = 1 AND datetime(timestamp) >= datetime('now', '-24 hours')", 
-            fetch_one=True
-        )
-        
-        # Calculate health score
-        health_score = 100
-        if critical_alerts['count'] > 0:
-            health_score -= min(40, critical_alerts['count'] * 15)
-        if alerts_count['count'] > 10:
-            health_score -= 20
-        if anomalies['count'] > recent_access['count'] * 0.1:
-            health_score -= 15
-        
-        health_score = max(0, health_score)
+        # Get health metrics in one statement; each subquery is a range scan
+        # over an index (unresolved alerts, the last day of access logs)
+        def build_health():
+            counts = execute_db_query('''
+                SELECT 
+                    (SELECT COUNT(*) FROM alerts WHERE resolved = 0) as active,
+                    (SELECT COUNT(*) FROM alerts WHERE resolved = 0 AND risk_score >= 0.8) as critical,
+                    (SELECT COUNT(*) FROM access_logs WHERE timestamp >= ?1) as daily,
+                    (SELECT COUNT(*) FROM access_logs
+                     WHERE anomaly_flag = 1 AND timestamp >= ?1) as anomalies
+            ''', (get_ist_timestamp_ago(hours=24),), fetch_one=True)
+            
+            # Calculate health score
+            health_score = 100
+            if counts['critical'] > 0:
+                health_score -= min(40, counts['critical'] * 15)
+            if counts['active'] > 10:
+                health_score -= 20
+            if counts['anomalies'] > counts['daily'] * 0.1:
+                health_score -= 15
+        
+            health_score = max(0, health_score)
+        
+            return {
+                "health_score": health_score,
+                "status": "Excellent" if health_score >= 90 else "Good" if health_score >= 70 else "Warning" if health_score >= 50 else "Critical",
+                "active_alerts": counts['active'],
+                "critical_alerts": counts['critical'],
+                "daily_access": counts['daily'],
+                "daily_anomalies": counts['anomalies']
+            }
         
-        return {
-            "health_score": health_score,
-            "status": "Excellent" if health_score >= 90 else "Good" if health_score >= 70 else "Warning" if health_score >= 50 else "Critical",
-            "active_alerts": alerts_count['count'],
-            "critical_alerts": critical_alerts['count'],
-            "daily_access": recent_access['count'],
-            "daily_anomalies": anomalies['count']
-        }
+        return await cached_json_response("health", build_health)
         
     except Exception as e:
         print(f"System health error: {e}")
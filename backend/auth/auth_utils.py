@@ -1,8 +1,8 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Optional
-import pytz # Import pytz
+import time
 
 # Security configuration
 SECRET_KEY = "your-secret-key-change-in-production"
@@ -10,7 +10,6 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-INDIA_TIMEZONE = pytz.timezone('Asia/Kolkata') # Define Indian timezone
 
 def hash_password(password: str) -> str:
     """Hash a password"""
@@ -23,11 +22,9 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(INDIA_TIMEZONE) + expires_delta
-    else:
-        expire = datetime.now(INDIA_TIMEZONE) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire.timestamp()}) # Store as Unix timestamp
+    # exp is a Unix timestamp, which is timezone independent
+    lifetime = expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": int(time.time() + lifetime.total_seconds())})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
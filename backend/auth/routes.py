@@ -2,22 +2,29 @@ from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from .models import UserCreate, UserLogin, Token, User
 from .auth_utils import hash_password, verify_password, create_access_token, verify_token
-from db import get_db_connection
+from db import execute_db_query
+from cachetools import TTLCache
 import sqlite3
+import threading
+import time
 
 router = APIRouter()
 security = HTTPBearer()
 
+# Every authenticated request resolves its token to a user; remember the
+# answer per token for a few seconds (never past the token's own expiry).
+# Users are changed directly in the database, with no route here to
+# invalidate from, so the short TTL bounds how long a deleted or demoted
+# user keeps their cached identity and role
+_token_user_cache = TTLCache(maxsize=1024, ttl=5)
+_token_user_cache_lock = threading.Lock()
+
 @router.post("/register", response_model=dict)
-async def register(user: UserCreate):
+def register(user: UserCreate):
     """Register a new user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
         # Check if username already exists
-        cursor.execute("SELECT id FROM users WHERE username = ?", (user.username,))
-        if cursor.fetchone():
+        if execute_db_query("SELECT id FROM users WHERE username = ?", (user.username,), fetch_one=True):
             raise HTTPException(
                 status_code=400,
                 detail="Username already registered"
@@ -25,12 +32,11 @@ async def register(user: UserCreate):
         
         # Hash password and create user
         hashed_password = hash_password(user.password)
-        cursor.execute('''
+        execute_db_query('''
             INSERT INTO users (username, password_hash, department, role)
             VALUES (?, ?, ?, ?)
         ''', (user.username, hashed_password, user.department, user.role))
         
-        conn.commit()
         return {"message": "User registered successfully"}
         
     except sqlite3.IntegrityError:
@@ -38,53 +44,48 @@ async def register(user: UserCreate):
             status_code=400,
             detail="Username already exists"
         )
-    finally:
-        conn.close()
 
 @router.post("/login", response_model=Token)
-async def login(user: UserLogin):
+def login(user: UserLogin):
     """Login user and return JWT token"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Get user from database
+    db_user = execute_db_query('''
+        SELECT id, username, password_hash, department, role
+        FROM users WHERE username = ?
+    ''', (user.username,), fetch_one=True)
     
-    try:
-        # Get user from database
-        cursor.execute('''
-            SELECT id, username, password_hash, department, role
-            FROM users WHERE username = ?
-        ''', (user.username,))
-        
-        db_user = cursor.fetchone()
-        if not db_user or not verify_password(user.password, db_user['password_hash']):
-            raise HTTPException(
-                status_code=401,
-                detail="Incorrect username or password"
-            )
-        
-        # Create access token
-        access_token = create_access_token(
-            data={"sub": db_user['username'], "user_id": db_user['id']}
-        )
-        
-        user_obj = User(
-            id=db_user['id'],
-            username=db_user['username'],
-            department=db_user['department'],
-            role=db_user['role']
-        )
-        
-        return Token(
-            access_token=access_token,
-            token_type="bearer",
-            user=user_obj
+    if not db_user or not verify_password(user.password, db_user['password_hash']):
+        raise HTTPException(
+            status_code=401,
+            detail="Incorrect username or password"
         )
-        
-    finally:
-        conn.close()
+    
+    # Create access token
+    access_token = create_access_token(
+        data={"sub": db_user['username'], "user_id": db_user['id']}
+    )
+    
+    user_obj = User(
+        id=db_user['id'],
+        username=db_user['username'],
+        department=db_user['department'],
+        role=db_user['role']
+    )
+    
+    return Token(
+        access_token=access_token,
+        token_type="bearer",
+        user=user_obj
+    )
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from JWT token"""
     token = credentials.credentials
+    with _token_user_cache_lock:
+        cached = _token_user_cache.get(token)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+    
     payload = verify_token(token)
     
     if payload is None:
@@ -93,28 +94,36 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid authentication credentials"
         )
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Runs on the shared connection instead of opening one per request
+    user = execute_db_query('''
+        SELECT id, username, department, role
+        FROM users WHERE username = ?
+    ''', (payload['sub'],), fetch_one=True)
     
-    try:
-        cursor.execute('''
-            SELECT id, username, department, role
-            FROM users WHERE username = ?
-        ''', (payload['sub'],))
-        
-        user = cursor.fetchone()
-        if user is None:
-            raise HTTPException(
-                status_code=401,
-                detail="User not found"
-            )
-        
-        return User(
-            id=user['id'],
-            username=user['username'],
-            department=user['department'],
-            role=user['role']
+    if user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="User not found"
         )
-        
-    finally:
-        conn.close()
\ No newline at end of file
+    
+    current_user = User(
+        id=user['id'],
+        username=user['username'],
+        department=user['department'],
+        role=user['role']
+    )
+    with _token_user_cache_lock:
+        _token_user_cache[token] = (current_user, payload.get('exp', 0))
+    return current_user
+
+async def require_admin(current_user: User = Depends(get_current_user)) -> User:
+    """Get current user, rejecting anyone who is not an admin"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def can_access_department(user: User, department: str) -> bool:
+    """Whether the user may read or change documents of a department"""
+    # Users arrive from the token cache already resolved, so this stays a
+    # plain comparison rather than another cached lookup
+    return user.role == "admin" or user.department == department
@@ -3,62 +3,368 @@
 import sqlite3
 from typing import Optional
 import os
-from datetime import datetime
-import pytz
+from datetime import datetime, timedelta, timezone
 import threading
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from contextlib import contextmanager
+from itertools import groupby
+from bisect import bisect_right
+from cachetools import TTLCache
 
 DATABASE_PATH = "database.db"
-INDIA_TIMEZONE = pytz.timezone('Asia/Kolkata')
+# IST is a fixed UTC+05:30 offset with no DST, so the stdlib timezone is
+# exact and avoids pytz's per-call localization
+INDIA_TIMEZONE = timezone(timedelta(hours=5, minutes=30))
+IST_OFFSET_SECONDS = 5 * 3600 + 30 * 60
 
-# Global connection with proper locking
-db_lock = threading.Lock()
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+NAT_NS = -2 ** 63  # int64 value numpy uses for NaT
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_current_timestamp = (None, "")  # (epoch second, formatted IST text)
+
+# One persistent connection per thread; WAL lets them read concurrently
+# and the busy timeout queues writers, so no process-wide lock is needed
+_thread_local = threading.local()
+_open_connections = []
+_open_connections_lock = threading.Lock()
+_connection_generation = 0
+
+# Access logs and alerts are queued by request handlers and written by a
+# single background thread, one transaction per batch of up to 1000 records
+# or 100ms. The queue is bounded so a stalled writer can't grow it forever
+WRITE_BATCH_SIZE = 1000
+WRITE_BATCH_INTERVAL = 0.1
+WRITE_QUEUE_SIZE = 10000
+_write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+def fallback_logger(name: str, filename: str) -> logging.Logger:
+    """Logger appending plain lines to filename from a background listener thread"""
+    # The listener keeps one file open and rotates it, instead of an
+    # open/write/close per failed event on the request path
+    records = queue.SimpleQueue()
+    handler = logging.handlers.RotatingFileHandler(filename, maxBytes=50_000_000,
+                                                   backupCount=5, delay=True)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger = logging.getLogger(name)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    return logger
+
+# Queued records the writer could not commit
+_write_fallback_log = fallback_logger("edg.fallback.writes", "writes_fallback.log")
+
+# Users never change department and documents keep theirs until deleted, so
+# log_access reads departments through a small TTL cache instead of the table
+_department_cache = TTLCache(maxsize=4096, ttl=300)
+_department_cache_lock = threading.Lock()
+_DEPARTMENT_QUERIES = {
+    'users': "SELECT department FROM users WHERE id = ?",
+    'documents': "SELECT department FROM documents WHERE id = ?"
+}
+_MISSING = object()
+
+# Access and alert classification rules
+UNAUTHORIZED_ACTIONS = frozenset({'unauthorized_upload_attempt', 'unauthorized_access_attempt'})
+CRITICAL_ALERT_TYPES = frozenset({'unauthorized_upload', 'unauthorized_access', 'data_leak_attempt'})
+HIGH_ALERT_TYPES = frozenset({'document_modified', 'cross_department_access'})
+# Risk scores from 0.4, 0.6 and 0.8 up are medium, high and critical
+SEVERITY_RISK_THRESHOLDS = (0.4, 0.6, 0.8)
+SEVERITY_LEVELS = ("low", "medium", "high", "critical")
 
 def get_db_connection():
     """Get SQLite database connection with proper configuration"""
+    # timeout is SQLite's busy timeout: wait up to 30s for another writer
+    # instead of failing with "database is locked"
     conn = sqlite3.connect(
         DATABASE_PATH, 
-        timeout=10.0,
-        check_same_thread=False
+        timeout=30.0,
+        check_same_thread=False,
+        cached_statements=256
     )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run alongside a writer and stays durable across
+    # crashes with NORMAL sync; sorts and temp tables stay in memory. Every
+    # worker thread holds a connection, so the private page cache is kept at
+    # 16MB and reads mostly go through the shared 256MB mmap instead of
+    # read() calls. In-memory databases have no WAL.
+    if DATABASE_PATH != ":memory:":
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16384")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+def get_thread_connection():
+    """Persistent connection owned by the calling thread, opened on first use"""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None or _thread_local.generation != _connection_generation:
+        conn = get_db_connection()
+        _thread_local.conn = conn
+        _thread_local.generation = _connection_generation
+        with _open_connections_lock:
+            _open_connections.append(conn)
     return conn
 
 def get_current_ist_timestamp():
     """Get current timestamp in Indian Time Zone (IST)"""
-    return datetime.now(INDIA_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    # The text only changes once a second, so it is formatted once per second
+    global _current_timestamp
+    second = int(time.time())
+    cached_second, text = _current_timestamp
+    if cached_second != second:
+        text = time.strftime(TIMESTAMP_FORMAT, time.gmtime(second + IST_OFFSET_SECONDS))
+        _current_timestamp = (second, text)
+    return text
+
+def get_ist_timestamp_ago(**delta) -> str:
+    """IST timestamp for a moment in the past, formatted like stored timestamps
+    so range filters compare the bare column and can use its indexes"""
+    return (datetime.now(INDIA_TIMEZONE) - timedelta(**delta)).strftime(TIMESTAMP_FORMAT)
 
-def execute_db_query(query, params=None, fetch_one=False, fetch_all=False):
-    """Execute database query with proper error handling"""
-    with db_lock:
-        conn = None
+def timestamp_to_epoch_ns(value) -> int:
+    """Parse an ISO-8601 timestamp into UTC epoch nanoseconds (naive values are UTC)"""
+    if isinstance(value, datetime):
+        dt = value
+    else:
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            dt = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return NAT_NS
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _ONE_MICROSECOND * 1000
+
+def timestamps_to_epoch_ns(values):
+    """Vectorized timestamp_to_epoch_ns returning an int64 numpy array"""
+    import numpy as np
+    import pandas as pd
+    
+    # Fast path for the format the app stores; anything else (ISO strings
+    # with a 'T' or an offset) is parsed one by one
+    values = list(values)
+    epoch_ns = pd.to_datetime(values, format=TIMESTAMP_FORMAT, utc=True,
+                              cache=True, errors='coerce').asi8.copy()
+    for i in np.flatnonzero(epoch_ns == NAT_NS):
+        epoch_ns[i] = timestamp_to_epoch_ns(values[i])
+    return epoch_ns
+
+def _ensure_writer():
+    """Start the background writer thread if it is not running"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_write_loop, name="db-writer", daemon=True)
+            _writer_thread.start()
+
+def enqueue_write(query, params, user_id: Optional[int] = None):
+    """Queue an INSERT for the background writer; user_id's behavior baseline
+    is invalidated once the row is committed. Queued records not yet
+    committed are lost if the process crashes"""
+    group = getattr(_thread_local, 'write_group', None)
+    if group is not None:
+        group.append((query, params, user_id))
+    else:
+        _put_write((query, params, user_id))
+
+@contextmanager
+def write_group():
+    """Queue the writes made in the block as one unit so they commit in the
+    same transaction, e.g. an access log together with its alert"""
+    if getattr(_thread_local, 'write_group', None) is not None:
+        # Already inside a group; its writes join the outer one
+        yield
+        return
+    group = _thread_local.write_group = []
+    try:
+        yield
+    finally:
+        _thread_local.write_group = None
+        if group:
+            _put_write(group)
+
+def _put_write(item):
+    """Hand a write, or a list of writes, to the background writer"""
+    _ensure_writer()
+    try:
+        _write_queue.put_nowait(item)
+    except queue.Full:
+        # Writer is behind; write this record in the caller's thread instead
+        _write_batch([item])
+
+def flush_pending_writes(timeout: float = 5.0):
+    """Wait until every write queued so far has been committed"""
+    if _writer_thread is None or not _writer_thread.is_alive():
+        return
+    done = threading.Event()
+    _write_queue.put(done)
+    done.wait(timeout)
+
+def _write_loop():
+    """Drain the write queue in batches until the process exits"""
+    while True:
+        batch = [_write_queue.get()]
+        deadline = time.monotonic() + WRITE_BATCH_INTERVAL
+        # Flush requests end the batch early instead of waiting out the interval
+        while len(batch) < WRITE_BATCH_SIZE and not isinstance(batch[-1], threading.Event):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_write_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _write_batch(batch)
+
+def _commit_writes(writes):
+    """Run queued (query, params, user_id) records in one transaction"""
+    # Consecutive records for the same statement go through one executemany
+    with db_transaction() as cursor:
+        for query, group in groupby(writes, key=lambda item: item[0]):
+            cursor.executemany(query, [item[1] for item in group])
+
+def _write_batch(batch):
+    """Commit a batch of queued writes in one transaction, unit by unit if that fails"""
+    # A write group stays one unit, so it commits or fails as a whole
+    units = [item if isinstance(item, list) else [item]
+             for item in batch if not isinstance(item, threading.Event)]
+    writes = [write for unit in units for write in unit]
+    try:
+        if writes:
+            try:
+                _commit_writes(writes)
+                committed = writes
+            except Exception as batch_error:
+                committed = _retry_writes(units, batch_error)
             
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
+            # Imported here because the analyzer imports this module
+            from anomaly.analyzer import invalidate_user_baseline
+            for user_id in {item[2] for item in committed if item[2] is not None}:
+                invalidate_user_baseline(user_id)
+    except Exception as e:
+        _write_fallback_log.error(f"{get_current_ist_timestamp()}: Failed to finish batch of "
+                                  f"{len(writes)} queued records - {e}")
+    finally:
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+def _retry_writes(units, batch_error):
+    """Commit each unit of a failed batch on its own so only bad records are
+    lost; returns the records that were committed"""
+    committed = []
+    error = batch_error
+    for unit in units:
+        # A locked or unavailable database fails every retry the same way,
+        # so the rest go straight to the fallback log
+        if not isinstance(error, sqlite3.OperationalError):
+            try:
+                _commit_writes(unit)
+                committed.extend(unit)
+                continue
+            except Exception as unit_error:
+                error = unit_error
+        for query, params, _ in unit:
+            _write_fallback_log.error(f"{get_current_ist_timestamp()}: {' '.join(query.split())} "
+                                      f"{params!r} - {error}")
+    return committed
+
+def close_db_connection():
+    """Flush queued writes and close every thread's connection; threads
+    reopen one on their next query"""
+    global _connection_generation
+    flush_pending_writes()
+    with _open_connections_lock:
+        _connection_generation += 1
+        for conn in _open_connections:
+            conn.close()
+        _open_connections.clear()
+
+atexit.register(close_db_connection)
+
+@contextmanager
+def db_transaction():
+    """Run several statements in one BEGIN IMMEDIATE ... COMMIT, yielding a cursor"""
+    conn = get_thread_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        yield cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+@contextmanager
+def db_connection():
+    """Share one connection across several execute_db_query calls"""
+    yield get_thread_connection()
+
+def execute_db_query(query, params=None, fetch_one=False, fetch_all=False, conn=None,
+                     fetch_all_raw=False):
+    """Execute database query with proper error handling; fetch_all_raw returns
+    the sqlite3.Row objects themselves for callers that only index by name"""
+    try:
+        if conn is None:
+            conn = get_thread_connection()
+        cursor = conn.cursor()
+        dict_rows = fetch_all and not (fetch_one or fetch_all_raw)
+        if dict_rows:
+            # Plain tuples zipped with the column names once per result set
+            # are cheaper than a dict copy of every sqlite3.Row
+            cursor.row_factory = None
+        
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        
+        if fetch_one:
+            result = cursor.fetchone()
+            return dict(result) if result else None
+        elif fetch_all_raw:
+            return cursor.fetchall()
+        elif dict_rows:
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        else:
+            conn.commit()
+            return cursor.lastrowid
             
-            if fetch_one:
-                result = cursor.fetchone()
-                conn.close()
-                return dict(result) if result else None
-            elif fetch_all:
-                result = cursor.fetchall()
-                conn.close()
-                return [dict(row) for row in result]
-            else:
-                conn.commit()
-                lastrowid = cursor.lastrowid
-                conn.close()
-                return lastrowid
-                
-        except Exception as e:
-            if conn:
-                conn.rollback()
-                conn.close()
-            raise e
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        raise e
+
+def _merge_duplicate_documents():
+    """Keep the lowest id per document filepath, pointing logs of the others at it"""
+    duplicates = execute_db_query('''
+        SELECT d.id, keep.id
+        FROM documents d
+        JOIN (SELECT filepath, MIN(id) as id FROM documents
+              GROUP BY filepath HAVING COUNT(*) > 1) keep
+        ON d.filepath = keep.filepath AND d.id != keep.id
+    ''', fetch_all_raw=True)
+    if not duplicates:
+        return
+    
+    with db_transaction() as cursor:
+        cursor.executemany("UPDATE access_logs SET doc_id = ? WHERE doc_id = ?",
+                           [(keep_id, doc_id) for doc_id, keep_id in duplicates])
+        cursor.executemany("DELETE FROM documents WHERE id = ?",
+                           [(doc_id,) for doc_id, _ in duplicates])
+    print(f"Merged {len(duplicates)} duplicate document rows")
 
 def init_database():
     """Initialize database with required tables"""
@@ -89,6 +395,35 @@ def init_database():
         )
     ''')
     
+    # Databases from before the unique index can hold several rows for one
+    # file (uploads updated them all together); merge them into the oldest
+    # row so the index can be created
+    _merge_duplicate_documents()
+    
+    # One row per file; lets sample seeding use INSERT OR IGNORE instead
+    # of a scan per document
+    execute_db_query('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_filepath
+        ON documents (filepath)
+    ''')
+    
+    # Serves document listings, per department and for admins, already in
+    # updated_at order
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_documents_dept_updated
+        ON documents (department, updated_at DESC)
+    ''')
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_documents_updated
+        ON documents (updated_at DESC)
+    ''')
+    
+    # Covers the document department lookup when joining access logs
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_documents_id_dept
+        ON documents (id, department)
+    ''')
+    
     # Access logs table with enhanced fields
     execute_db_query('''
         CREATE TABLE IF NOT EXISTS access_logs (
@@ -107,6 +442,50 @@ def init_database():
         )
     ''')
     
+    # Per-user time window lookups; including action lets bulk operation
+    # detection run from the index alone. Replaces the narrower
+    # (user_id, timestamp) index.
+    execute_db_query('DROP INDEX IF EXISTS idx_access_logs_user_ts')
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_access_logs_user_ts_action
+        ON access_logs (user_id, timestamp, action)
+    ''')
+    
+    # Per-user document lookups (department access violations)
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_access_logs_user_doc
+        ON access_logs (user_id, doc_id)
+    ''')
+    
+    # Newest-first listings (dashboard, access logs, data leaks) walk this
+    # index and stop at their LIMIT instead of sorting the table; the id
+    # tie-breaker serves keyset pagination. Replaces the timestamp-only index.
+    execute_db_query('DROP INDEX IF EXISTS idx_access_logs_ts')
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_access_logs_ts_id
+        ON access_logs (timestamp DESC, id DESC)
+    ''')
+    
+    # Per-document history (modification timeline), newest first
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_access_logs_doc_ts
+        ON access_logs (doc_id, timestamp DESC)
+    ''')
+    
+    # Partial index holding only anomalous logs
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_access_logs_anomaly_ts
+        ON access_logs (anomaly_flag, timestamp DESC) WHERE anomaly_flag = 1
+    ''')
+    
+    # Partial covering index for the cross-department access summary; its
+    # WHERE clause matches the summary query term for term
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_access_logs_cross_dept
+        ON access_logs (timestamp, user_department, document_department, risk_score, anomaly_flag)
+        WHERE user_department != document_department AND document_department IS NOT NULL
+    ''')
+    
     # Alerts table with severity field
     execute_db_query('''
         CREATE TABLE IF NOT EXISTS alerts (
@@ -123,6 +502,30 @@ def init_database():
         )
     ''')
     
+    # Unresolved alert counts and listings
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_resolved_ts
+        ON alerts (resolved, timestamp DESC, risk_score)
+    ''')
+    
+    # Alert listings filtered by severity
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_resolved_severity_ts
+        ON alerts (resolved, severity, timestamp DESC)
+    ''')
+    
+    # Per-user alert lookups
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_user_id
+        ON alerts (user_id)
+    ''')
+    
+    # Newest-first alert pages
+    execute_db_query('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_ts_id
+        ON alerts (timestamp DESC, id DESC)
+    ''')
+    
     # Create sample data
     create_sample_data()
 
@@ -137,35 +540,28 @@ def create_sample_data():
     if admin_count['count'] == 0:
         from auth.auth_utils import hash_password
         
-        # Create admin user
-        admin_hash = hash_password("admin123")
-        execute_db_query('''
-            INSERT INTO users (username, password_hash, department, role, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', ("admin", admin_hash, "IT", "admin", get_current_ist_timestamp()))
-        
-        # Create sample users
+        # Admin and sample users; hashed before the transaction so bcrypt
+        # does not hold the write lock
         users_data = [
+            ("admin", hash_password("admin123"), "IT", "admin", get_current_ist_timestamp()),
             ("john_hr", hash_password("password123"), "HR", "user", get_current_ist_timestamp()),
             ("sarah_finance", hash_password("password123"), "Finance", "user", get_current_ist_timestamp()),
             ("mike_legal", hash_password("password123"), "Legal", "user", get_current_ist_timestamp()),
         ]
         
-        for user_data in users_data:
-            execute_db_query('''
+        # All users in one transaction, one commit
+        with db_transaction() as cursor:
+            cursor.executemany('''
                 INSERT INTO users (username, password_hash, department, role, created_at)
                 VALUES (?, ?, ?, ?, ?)
-            ''', user_data)
+            ''', users_data)
     
     # Create sample documents
     create_sample_documents()
 
-def create_sample_documents():
-    """Create sample document files"""
-    import hashlib
-    
-    documents = {
-        "static/docs/HR/employee_handbook.txt": """
+# Sample documents seeded on first start, as (filepath, content) pairs
+_SAMPLE_DOCUMENT_TEXTS = {
+    "static/docs/HR/employee_handbook.txt": """
 EMPLOYEE HANDBOOK - HR DEPARTMENT
 =================================
 
@@ -175,9 +571,9 @@ EMPLOYEE HANDBOOK - HR DEPARTMENT
 4. Benefits Information
 
 This is a sample HR document.
-        """,
-        
-        "static/docs/Finance/budget_2024.txt": """
+    """,
+    
+    "static/docs/Finance/budget_2024.txt": """
 ANNUAL BUDGET 2024 - FINANCE DEPARTMENT
 ======================================
 
@@ -187,9 +583,9 @@ Q3 Budget: $110,000
 Q4 Budget: $130,000
 
 This is a sample Finance document.
-        """,
-        
-        "static/docs/Legal/contract_template.txt": """
+    """,
+    
+    "static/docs/Legal/contract_template.txt": """
 CONTRACT TEMPLATE - LEGAL DEPARTMENT
 ====================================
 
@@ -199,91 +595,110 @@ TERMS AND CONDITIONS
 - Legal obligations
 
 This is a sample Legal document.
-        """
-    }
+    """
+}
+# (department, filename, filepath, content bytes), with the department and
+# filename taken from each path once at import
+_SAMPLE_DOCUMENTS = tuple((filepath.split('/')[2], os.path.basename(filepath), filepath,
+                           content.strip().encode())
+                          for filepath, content in _SAMPLE_DOCUMENT_TEXTS.items())
+
+def create_sample_documents():
+    """Create sample document files"""
+    from documents.versioning import hash_content, calculate_file_hash
     
-    # Create directories and files
-    for filepath, content in documents.items():
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w') as f:
-            f.write(content.strip())
+    # Create directories and files, leaving files that already hold the
+    # sample content untouched
+    sample_documents = []
+    for department, filename, filepath, data in _SAMPLE_DOCUMENTS:
+        file_hash = hash_content(data)
+        if calculate_file_hash(filepath) != file_hash:
+            # Replaced rather than rewritten in place, since an upload's
+            # .backup may be a hard link to the current file
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(f"{filepath}.tmp", 'wb') as f:
+                f.write(data)
+            os.replace(f"{filepath}.tmp", filepath)
+        
+        sample_documents.append((filename, department, filepath, file_hash, 1,
+                                 get_current_ist_timestamp(), get_current_ist_timestamp()))
     
     # Create uploads directory
     os.makedirs("static/docs/uploads", exist_ok=True)
     
-    # Add documents to database
-    for filepath, content in documents.items():
-        # Extract department from filepath
-        parts = filepath.split('/')
-        department = parts[2]
-        filename = parts[-1]
-        
-        # Calculate hash
-        file_hash = hashlib.md5(content.encode()).hexdigest()
-        
-        # Check if document already exists
-        existing = execute_db_query(
-            "SELECT COUNT(*) as count FROM documents WHERE filepath = ?", 
-            (filepath,), 
-            fetch_one=True
-        )
-        
-        if existing['count'] == 0:
-            execute_db_query('''
-                INSERT INTO documents (name, department, filepath, version_hash, modified_by, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (filename, department, filepath, file_hash, 1, get_current_ist_timestamp(), get_current_ist_timestamp()))
+    # Add documents to database in one transaction. Documents already
+    # registered only get their version hash set to the sample file now on
+    # disk, which rewrites the MD5 hashes older databases stored
+    with db_transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO documents (name, department, filepath, version_hash, modified_by, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (filepath) DO UPDATE SET version_hash = excluded.version_hash
+            WHERE version_hash != excluded.version_hash
+        ''', sample_documents)
+
+def cached_department(table: str, row_id: Optional[int]) -> Optional[str]:
+    """Department of a user or document, None when the row doesn't exist"""
+    if row_id is None:
+        return None
+    key = (table, row_id)
+    with _department_cache_lock:
+        department = _department_cache.get(key, _MISSING)
+    if department is not _MISSING:
+        return department
+    
+    row = get_thread_connection().execute(_DEPARTMENT_QUERIES[table], (row_id,)).fetchone()
+    department = row[0] if row else None
+    with _department_cache_lock:
+        _department_cache[key] = department
+    return department
+
+def invalidate_document_department(doc_id: int):
+    """Forget the cached department of a deleted or re-registered document"""
+    with _department_cache_lock:
+        _department_cache.pop(('documents', doc_id), None)
 
 def log_access(user_id: int, doc_id: Optional[int], document_name: str, action: str, 
                anomaly_flag: bool = False, risk_score: float = 0.0):
     """Enhanced access logging with anomaly detection"""
     try:
-        # Get user and document departments
-        user_dept = execute_db_query(
-            "SELECT department FROM users WHERE id = ?", 
-            (user_id,), fetch_one=True
-        )
-        user_department = user_dept['department'] if user_dept else 'Unknown'
-        
-        doc_department = None
-        if doc_id:
-            doc_dept = execute_db_query(
-                "SELECT department FROM documents WHERE id = ?", 
-                (doc_id,), fetch_one=True
-            )
-            doc_department = doc_dept['department'] if doc_dept else None
+        user_department = cached_department('users', user_id) or 'Unknown'
+        document_department = cached_department('documents', doc_id)
         
-        # Calculate risk score for unauthorized actions
-        if action in ['unauthorized_upload_attempt', 'unauthorized_access_attempt']:
-            risk_score = max(risk_score, 0.8)
-            anomaly_flag = True
-        elif doc_department and user_department != doc_department:
-            risk_score = max(risk_score, 0.6)
-            anomaly_flag = True
+        # Unauthorized actions score at least 0.8, cross-department access
+        # at least 0.6, and both are flagged as anomalies
+        if action in UNAUTHORIZED_ACTIONS:
+            anomaly_flag, risk_score = True, max(risk_score, 0.8)
+        elif document_department and user_department != document_department:
+            anomaly_flag, risk_score = True, max(risk_score, 0.6)
         
-        execute_db_query('''
+        # Queued for the background writer; the timestamp is taken now
+        enqueue_write('''
             INSERT INTO access_logs (user_id, doc_id, document_name, action, timestamp, 
                                    anomaly_flag, risk_score, user_department, document_department)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, doc_id, document_name, action, get_current_ist_timestamp(), 
-              anomaly_flag, risk_score, user_department, doc_department))
+              anomaly_flag, risk_score, user_department, document_department), user_id=user_id)
     except Exception as e:
         print(f"Failed to log access: {e}")
 
+def alert_severity(alert_type: str, risk_score: float,
+                   critical_types=CRITICAL_ALERT_TYPES, high_types=HIGH_ALERT_TYPES) -> str:
+    """Determine severity based on alert type and risk score"""
+    level = bisect_right(SEVERITY_RISK_THRESHOLDS, risk_score)
+    if alert_type in critical_types:
+        level = 3
+    elif alert_type in high_types:
+        level = max(level, 2)
+    return SEVERITY_LEVELS[level]
+
 def create_alert(user_id: int, document_name: str, alert_type: str, description: str, 
                  risk_score: float = 0.0):
     """Enhanced alert creation with risk scoring"""
     try:
-        # Determine severity based on alert type and risk score
-        severity = "low"
-        if alert_type in ['unauthorized_upload', 'unauthorized_access', 'data_leak_attempt'] or risk_score >= 0.8:
-            severity = "critical"
-        elif alert_type in ['document_modified', 'cross_department_access'] or risk_score >= 0.6:
-            severity = "high"
-        elif risk_score >= 0.4:
-            severity = "medium"
+        severity = alert_severity(alert_type, risk_score)
         
-        execute_db_query('''
+        enqueue_write('''
             INSERT INTO alerts (user_id, document_name, alert_type, description, timestamp, risk_score, severity)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, document_name, alert_type, description, get_current_ist_timestamp(), risk_score, severity))
@@ -1,48 +1,39 @@
 # backend/documents/access_log.py - Fixed Version with Proper Connection Management
 
-from db import get_db_connection, execute_db_query, get_current_ist_timestamp
-from datetime import datetime, timedelta
-from typing import Optional
-import pytz
-import sqlite3
-import time
+from db import get_thread_connection, execute_db_query, get_current_ist_timestamp, get_ist_timestamp_ago, timestamps_to_epoch_ns, cached_department, alert_severity, fallback_logger
+from typing import Optional, Dict
+import numpy as np
 
-INDIA_TIMEZONE = pytz.timezone('Asia/Kolkata')
+# Alert types that are severe regardless of their risk score
+CRITICAL_ALERT_TYPES = frozenset({'data_leak_attempt', 'data_sabotage_attempt'})
+HIGH_ALERT_TYPES = frozenset({'document_tampering', 'unauthorized_access'})
+
+_access_fallback_log = fallback_logger("edg.fallback.access", "access_logs_fallback.log")
+_alert_fallback_log = fallback_logger("edg.fallback.alerts", "alerts_fallback.log")
 
 def log_access(user_id: int, doc_id: Optional[int], document_name: str, 
                action: str, anomaly_flag: bool = False, risk_score: float = 0.0):
     """Enhanced log document access/modification with cross-department tracking"""
     try:
-        # Get user department
-        user_dept = execute_db_query(
-            "SELECT department FROM users WHERE id = ?", 
-            (user_id,), fetch_one=True
-        )
-        user_department = user_dept['department'] if user_dept else 'Unknown'
-        
-        # Get document department if doc_id is provided
-        document_department = None
-        if doc_id:
-            doc_dept = execute_db_query(
-                "SELECT department FROM documents WHERE id = ?", 
-                (doc_id,), fetch_one=True
-            )
-            document_department = doc_dept['department'] if doc_dept else None
-        
-        # Enhanced logging with department tracking
+        # Enhanced logging with department tracking; both departments come
+        # from the shared department cache
         log_id = execute_db_query('''
             INSERT INTO access_logs 
             (user_id, doc_id, document_name, action, anomaly_flag, risk_score, timestamp, user_department, document_department)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, doc_id, document_name, action, anomaly_flag, risk_score, 
-              get_current_ist_timestamp(), user_department, document_department))
+              get_current_ist_timestamp(), cached_department('users', user_id) or 'Unknown',
+              cached_department('documents', doc_id)))
+        
+        # Imported here because the analyzer imports this module
+        from anomaly.analyzer import invalidate_user_baseline
+        invalidate_user_baseline(user_id)
         
         return log_id
                 
     except Exception as e:
         # Log to file as fallback
-        with open("access_logs_fallback.log", "a") as f:
-            f.write(f"{get_current_ist_timestamp()}: User {user_id} - {action} on {document_name}\n")
+        _access_fallback_log.error(f"{get_current_ist_timestamp()}: User {user_id} - {action} on {document_name}")
         print(f"Failed to log access: {e}")
         return None
 
@@ -50,14 +41,7 @@ def create_alert(user_id: int, document_name: str, alert_type: str,
                  description: str, risk_score: float = 0.0):
     """Enhanced create security alert with severity classification"""
     try:
-        # Determine severity based on alert type and risk score
-        severity = "low"
-        if alert_type in ['data_leak_attempt', 'data_sabotage_attempt'] or risk_score >= 0.8:
-            severity = "critical"
-        elif alert_type in ['document_tampering', 'unauthorized_access'] or risk_score >= 0.6:
-            severity = "high"
-        elif risk_score >= 0.4:
-            severity = "medium"
+        severity = alert_severity(alert_type, risk_score, CRITICAL_ALERT_TYPES, HIGH_ALERT_TYPES)
         
         alert_id = execute_db_query('''
             INSERT INTO alerts (user_id, document_name, alert_type, description, risk_score, timestamp, severity)
@@ -69,20 +53,29 @@ def create_alert(user_id: int, document_name: str, alert_type: str,
                 
     except Exception as e:
         # Log to file as fallback
-        with open("alerts_fallback.log", "a") as f:
-            f.write(f"{get_current_ist_timestamp()}: Alert {alert_type} for user {user_id} - {description}\n")
+        _alert_fallback_log.error(f"{get_current_ist_timestamp()}: Alert {alert_type} for user {user_id} - {description}")
         print(f"Failed to create alert: {e}")
         return None
 
 def get_access_logs(limit: int = 100, user_id: Optional[int] = None, 
-                   department: Optional[str] = None, anomalies_only: bool = False):
-    """Get access logs with enhanced filtering options"""
+                   department: Optional[str] = None, anomalies_only: bool = False,
+                   as_arrays: bool = False):
+    """Get access logs with enhanced filtering options, or training columns as numpy arrays"""
     try:
-        query = '''
-            SELECT al.*, u.username, u.department
-            FROM access_logs al
-            JOIN users u ON al.user_id = u.id
-        '''
+        if as_arrays:
+            # The department mismatch flag is computed by SQLite
+            query = '''
+                SELECT al.user_id, al.timestamp, al.action,
+                       u.department IS NOT al.user_department
+                FROM access_logs al
+                JOIN users u ON al.user_id = u.id
+            '''
+        else:
+            query = '''
+                SELECT al.*, u.username, u.department
+                FROM access_logs al
+                JOIN users u ON al.user_id = u.id
+            '''
         params = []
         conditions = []
         
@@ -103,11 +96,29 @@ def get_access_logs(limit: int = 100, user_id: Optional[int] = None,
         query += " ORDER BY al.timestamp DESC LIMIT ?"
         params.append(limit)
         
+        if as_arrays:
+            conn = get_thread_connection()
+            return _access_log_arrays(conn.execute(query, params).fetchall())
+        
         return execute_db_query(query, params, fetch_all=True) or []
             
     except Exception as e:
         print(f"Error getting access logs: {e}")
-        return []  # Return empty list on persistent database issues
+        # Return empty results on persistent database issues
+        return _access_log_arrays([]) if as_arrays else []
+
+def _access_log_arrays(rows) -> Dict:
+    """Unpack (user_id, timestamp, action, dept_mismatch) rows into typed numpy arrays"""
+    count = len(rows)
+    actions, action_ids = np.unique(np.array([row[2] for row in rows], dtype=object),
+                                    return_inverse=True)
+    return {
+        'user_id': np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+        'ts_ns': timestamps_to_epoch_ns([row[1] for row in rows]),
+        'action_id': action_ids.astype(np.int32),
+        'actions': actions.tolist(),
+        'dept_mismatch': np.fromiter((row[3] for row in rows), dtype=np.uint8, count=count)
+    }
 
 def get_alerts(resolved: bool = False, limit: int = 100, severity: Optional[str] = None,
                alert_type: Optional[str] = None):
@@ -154,12 +165,12 @@ def get_cross_department_access_summary(days: int = 7):
             FROM access_logs
             WHERE user_department != document_department
             AND document_department IS NOT NULL
-            AND datetime(timestamp) >= datetime('now', '-{} days')
+            AND timestamp >= ?
             GROUP BY user_department, document_department
             ORDER BY access_count DESC
-        '''.format(days)
+        '''
         
-        return execute_db_query(query, fetch_all=True) or []
+        return execute_db_query(query, (get_ist_timestamp_ago(days=days),), fetch_all=True) or []
             
     except Exception as e:
         print(f"Error getting cross-department access summary: {e}")
@@ -190,8 +201,41 @@ def get_document_modification_timeline(doc_id: int):
 def get_user_access_pattern(user_id: int, days: int = 30):
     """Analyze user access patterns for anomaly detection"""
     try:
-        # Get user's access history
-        query = '''
+        since_time = get_ist_timestamp_ago(days=days)
+        
+        # Scalar stats in one aggregate pass over the user's time window
+        stats = execute_db_query('''
+            SELECT 
+                COUNT(*) as total_access,
+                COUNT(CASE WHEN document_department != '' 
+                           AND document_department IS NOT user_department THEN 1 END) as cross_dept_access,
+                COUNT(CASE WHEN anomaly_flag THEN 1 END) as anomaly_count,
+                COALESCE(SUM(risk_score), 0) as risk_total
+            FROM access_logs
+            WHERE user_id = ?1
+            AND timestamp >= ?2
+        ''', (user_id, since_time), fetch_one=True)
+        
+        total_access = stats['total_access']
+        cross_dept_access = stats['cross_dept_access']
+        anomaly_count = stats['anomaly_count']
+        avg_risk_score = stats['risk_total'] / max(1, total_access)
+        
+        # Most active hours
+        hour_rows = execute_db_query('''
+            SELECT strftime('%H', timestamp) as hour, COUNT(*) as count
+            FROM access_logs
+            WHERE user_id = ?1
+            AND timestamp >= ?2
+            GROUP BY hour
+            HAVING hour IS NOT NULL
+            ORDER BY count DESC, MAX(timestamp) DESC
+            LIMIT 3
+        ''', (user_id, since_time), fetch_all_raw=True)
+        most_active_hours = [(row['hour'], row['count']) for row in hour_rows]
+        
+        # Only the latest logs are returned in full
+        recent_logs = execute_db_query('''
             SELECT 
                 action,
                 document_department,
@@ -202,30 +246,11 @@ def get_user_access_pattern(user_id: int, days: int = 30):
                 strftime('%H', timestamp) as hour,
                 strftime('%w', timestamp) as day_of_week
             FROM access_logs al
-            WHERE al.user_id = ?
-            AND datetime(timestamp) >= datetime('now', '-{} days')
+            WHERE al.user_id = ?1
+            AND timestamp >= ?2
             ORDER BY timestamp DESC
-        '''.format(days)
-        
-        access_logs = execute_db_query(query, (user_id,), fetch_all=True) or []
-        
-        # Calculate patterns
-        total_access = len(access_logs)
-        cross_dept_access = len([log for log in access_logs 
-                                if log.get('document_department') and 
-                                log.get('document_department') != log.get('user_department')])
-        
-        anomaly_count = len([log for log in access_logs if log.get('anomaly_flag')])
-        avg_risk_score = sum(log.get('risk_score', 0) for log in access_logs) / max(1, total_access)
-        
-        # Most active hours
-        hour_counts = {}
-        for log in access_logs:
-            hour = log.get('hour')
-            if hour:
-                hour_counts[hour] = hour_counts.get(hour, 0) + 1
-        
-        most_active_hours = sorted(hour_counts.items(), key=lambda x: x[1], reverse=True)[:3]
+            LIMIT 10
+        ''', (user_id, since_time), fetch_all=True) or []
         
         return {
             'total_access': total_access,
@@ -235,7 +260,7 @@ def get_user_access_pattern(user_id: int, days: int = 30):
             'anomaly_percentage': (anomaly_count / max(1, total_access)) * 100,
             'avg_risk_score': avg_risk_score,
             'most_active_hours': most_active_hours,
-            'recent_logs': access_logs[:10]
+            'recent_logs': recent_logs
         }
             
     except Exception as e:
@@ -1,45 +1,99 @@
 # backend/documents/routes.py - FIXED VERSION - Actually Working
 
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks
 from fastapi.responses import FileResponse
-from auth.routes import get_current_user
+from auth.routes import get_current_user, can_access_department
 from auth.models import User
-from db import execute_db_query, get_current_ist_timestamp, log_access, create_alert
+from db import execute_db_query, get_current_ist_timestamp, log_access, create_alert, invalidate_document_department, write_group
 from anomaly.analyzer import analyze_access_pattern
+from response_cache import invalidate_cached_responses
+from documents.versioning import new_content_hash, ensure_dir, files_equal, MAX_DIFF_CHARS
+from cachetools import TTLCache
 import os
 import shutil
-import hashlib
+import threading
 
 router = APIRouter()
 
-def calculate_file_hash(filepath):
-    """Calculate MD5 hash of file"""
-    try:
-        with open(filepath, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
-    except:
-        return ""
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Unauthorized attempts are scored at least 0.8 whatever the model says, so
+# repeated attempts reuse the user's score for a minute instead of running
+# the model on every denied request
+_unauthorized_risk_cache = TTLCache(maxsize=4096, ttl=60)
+_unauthorized_risk_cache_lock = threading.Lock()
+
+# Document listings per department (None for admins); uploads and deletes
+# clear it, the TTL bounds staleness from writes made elsewhere
+_document_list_cache = TTLCache(maxsize=256, ttl=5)
+_document_list_cache_lock = threading.Lock()
+
+# The model scores the user, action, department and current hour, so a
+# score stays valid for a few seconds during bursts of requests
+_risk_cache = TTLCache(maxsize=10_000, ttl=5)
+_risk_cache_lock = threading.Lock()
+
+# Document rows by id for downloads and deletes; uploads and deletes drop
+# their row, the TTL bounds staleness from writes made elsewhere
+_document_cache = TTLCache(maxsize=1024, ttl=60)
+_document_cache_lock = threading.Lock()
+
+def _query_documents(department):
+    """Documents of a department, or all of them for None, with the listed columns"""
+    if department is None:
+        return execute_db_query('''
+            SELECT d.id, d.name, d.department, d.updated_at, u.username as modified_by_username
+            FROM documents d
+            LEFT JOIN users u ON d.modified_by = u.id
+            ORDER BY d.updated_at DESC
+        ''', fetch_all=True)
+    return execute_db_query('''
+        SELECT d.id, d.name, d.department, d.updated_at, u.username as modified_by_username
+        FROM documents d
+        LEFT JOIN users u ON d.modified_by = u.id
+        WHERE d.department = ?
+        ORDER BY d.updated_at DESC
+    ''', (department,), fetch_all=True)
+
+def _get_document(doc_id: int):
+    """Document row by id, cached; missing documents are not cached"""
+    with _document_cache_lock:
+        document = _document_cache.get(doc_id)
+    if document is None:
+        document = execute_db_query(
+            "SELECT * FROM documents WHERE id = ?", 
+            (doc_id,), 
+            fetch_one=True
+        )
+        if document:
+            with _document_cache_lock:
+                _document_cache[doc_id] = document
+    return document
+
+def _invalidate_document(doc_id: int):
+    """Drop the cached row of an updated or deleted document"""
+    with _document_cache_lock:
+        _document_cache.pop(doc_id, None)
+
+def _invalidate_document_lists():
+    """Drop cached listings after the documents table changed"""
+    with _document_list_cache_lock:
+        _document_list_cache.clear()
 
 @router.get("/list")
-async def list_documents(current_user: User = Depends(get_current_user)):
+def list_documents(current_user: User = Depends(get_current_user)):
     """List documents accessible to user"""
     try:
-        if current_user.role == "admin":
-            documents = execute_db_query('''
-                SELECT d.*, u.username as modified_by_username
-                FROM documents d
-                LEFT JOIN users u ON d.modified_by = u.id
-                ORDER BY d.updated_at DESC
-            ''', fetch_all=True)
-        else:
-            documents = execute_db_query('''
-                SELECT d.*, u.username as modified_by_username
-                FROM documents d
-                LEFT JOIN users u ON d.modified_by = u.id
-                WHERE d.department = ?
-                ORDER BY d.updated_at DESC
-            ''', (current_user.department,), fetch_all=True)
+        scope = None if current_user.role == "admin" else current_user.department
+        with _document_list_cache_lock:
+            documents = _document_list_cache.get(scope)
         
+        if documents is None:
+            documents = _query_documents(scope)
+            with _document_list_cache_lock:
+                _document_list_cache[scope] = documents
+        
+        # Every listing is still logged
         log_access(current_user.id, None, "document_list", "list")
         return {"documents": documents}
         
@@ -47,53 +101,92 @@ async def list_documents(current_user: User = Depends(get_current_user)):
         print(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail="Failed to list documents")
 
+def _risk_score(user_id: int, action: str, department: str) -> float:
+    """ML-based risk score, memoized per (user, action, department) for 5 seconds"""
+    key = (user_id, action, department)
+    with _risk_cache_lock:
+        risk_score = _risk_cache.get(key)
+    if risk_score is None:
+        risk_score = analyze_access_pattern(user_id, action, department)
+        with _risk_cache_lock:
+            _risk_cache[key] = risk_score
+    return risk_score
+
+def _link_or_copy(src: str, dst: str):
+    """Point dst at src's current contents, by hard link where the filesystem allows"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _unauthorized_risk_score(user: User, action: str) -> float:
+    """ML-based risk score for an unauthorized attempt, never below 0.8"""
+    key = (user.id, action)
+    with _unauthorized_risk_cache_lock:
+        risk_score = _unauthorized_risk_cache.get(key)
+    if risk_score is None:
+        risk_score = max(0.8, analyze_access_pattern(user.id, action, user.department))
+        with _unauthorized_risk_cache_lock:
+            _unauthorized_risk_cache[key] = risk_score
+    return risk_score
+
+def _log_download(user_id: int, doc_id: int, document_name: str, department: str):
+    """Score and log a download; runs after the file has been sent"""
+    # Calculate ML-based risk score for legitimate access
+    risk_score = _risk_score(user_id, "download", department)
+    is_anomaly = risk_score >= 0.7
+    
+    # Log successful access with ML-calculated risk score
+    log_access(user_id, doc_id, document_name, "download", 
+              anomaly_flag=is_anomaly, risk_score=risk_score)
+
 @router.get("/download/{doc_id}")
-async def download_document(doc_id: int, current_user: User = Depends(get_current_user)):
+def download_document(doc_id: int, background_tasks: BackgroundTasks,
+                      current_user: User = Depends(get_current_user)):
     """Download a document"""
     try:
-        document = execute_db_query(
-            "SELECT * FROM documents WHERE id = ?", 
-            (doc_id,), 
-            fetch_one=True
-        )
+        document = _get_document(doc_id)
         
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Check permissions for non-admin users
-        if current_user.role != "admin" and document['department'] != current_user.department:
+        if not can_access_department(current_user, document['department']):
             # Calculate ML-based risk score for unauthorized access
-            risk_score = analyze_access_pattern(current_user.id, "unauthorized_access_attempt", current_user.department)
-            risk_score = max(0.8, risk_score)  # Unauthorized access is always high risk
+            risk_score = _unauthorized_risk_score(current_user, "unauthorized_access_attempt")  # Unauthorized access is always high risk
             
             # Log potential data leak attempt with ML risk score
-            log_access(current_user.id, doc_id, document['name'], "unauthorized_access_attempt", 
-                      anomaly_flag=True, risk_score=risk_score)
-            create_alert(
-                current_user.id, 
-                document['name'], 
-                "unauthorized_access",
-                f"User from {current_user.department} tried to access {document['department']} document",
-                risk_score
-            )
+            with write_group():
+                log_access(current_user.id, doc_id, document['name'], "unauthorized_access_attempt", 
+                          anomaly_flag=True, risk_score=risk_score)
+                create_alert(
+                    current_user.id, 
+                    document['name'], 
+                    "unauthorized_access",
+                    f"User from {current_user.department} tried to access {document['department']} document",
+                    risk_score
+                )
             raise HTTPException(status_code=403, detail="Access denied")
         
+        # One stat both checks the file exists and gives FileResponse its
+        # Content-Length and Last-Modified headers
         filepath = document['filepath']
-        if not os.path.exists(filepath):
+        try:
+            stat_result = os.stat(filepath)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Calculate ML-based risk score for legitimate access
-        risk_score = analyze_access_pattern(current_user.id, "download", current_user.department)
-        is_anomaly = risk_score >= 0.7
-        
-        # Log successful access with ML-calculated risk score
-        log_access(current_user.id, doc_id, document['name'], "download", 
-                  anomaly_flag=is_anomaly, risk_score=risk_score)
+        # Scoring and logging the download wait until the file is on its way
+        background_tasks.add_task(_log_download, current_user.id, doc_id,
+                                  document['name'], current_user.department)
         
         return FileResponse(
             path=filepath,
             filename=document['name'],
-            media_type='application/octet-stream'
+            media_type='application/octet-stream',
+            stat_result=stat_result
         )
         
     except HTTPException:
@@ -103,7 +196,7 @@ async def download_document(doc_id: int, current_user: User = Depends(get_curren
         raise HTTPException(status_code=500, detail="Failed to download document")
 
 @router.post("/upload")
-async def upload_document(
+def upload_document(
     file: UploadFile = File(...),
     department: str = Form(...),
     current_user: User = Depends(get_current_user)
@@ -111,100 +204,121 @@ async def upload_document(
     """Upload a document"""
     try:
         # Check permissions for non-admin users
-        if current_user.role != "admin" and department != current_user.department:
+        if not can_access_department(current_user, department):
             # Calculate ML-based risk score for unauthorized upload
-            risk_score = analyze_access_pattern(current_user.id, "unauthorized_upload_attempt", current_user.department)
-            risk_score = max(0.8, risk_score)  # Unauthorized upload is always high risk
+            risk_score = _unauthorized_risk_score(current_user, "unauthorized_upload_attempt")  # Unauthorized upload is always high risk
             
-            log_access(current_user.id, None, file.filename, "unauthorized_upload_attempt", 
-                      anomaly_flag=True, risk_score=risk_score)
-            create_alert(
-                current_user.id,
-                file.filename,
-                "unauthorized_upload",
-                f"User tried to upload to {department} department",
-                risk_score
-            )
+            with write_group():
+                log_access(current_user.id, None, file.filename, "unauthorized_upload_attempt", 
+                          anomaly_flag=True, risk_score=risk_score)
+                create_alert(
+                    current_user.id,
+                    file.filename,
+                    "unauthorized_upload",
+                    f"User tried to upload to {department} department",
+                    risk_score
+                )
             raise HTTPException(status_code=403, detail="Cannot upload to other departments")
         
         # Create department directory
         dept_dir = f"static/docs/{department}"
-        os.makedirs(dept_dir, exist_ok=True)
+        ensure_dir(dept_dir)
         
         # Save file
         filepath = os.path.join(dept_dir, file.filename)
         
-        # Check if file already exists
+        # Check if file already exists; its stored version hash stands in
+        # for re-hashing the file on disk
         file_exists = os.path.exists(filepath)
         old_hash = ""
-        
-        if file_exists:
-            old_hash = calculate_file_hash(filepath)
-            # Create backup
-            backup_path = f"{filepath}.backup"
-            shutil.copy2(filepath, backup_path)
-        
-        # Save uploaded file
-        with open(filepath, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Calculate new hash
-        new_hash = calculate_file_hash(filepath)
+        doc_id = None
         
         if file_exists:
             # Get existing document ID
             existing_doc = execute_db_query(
-                "SELECT id FROM documents WHERE filepath = ?", 
+                "SELECT id, version_hash FROM documents WHERE filepath = ?", 
                 (filepath,), fetch_one=True
             )
-            doc_id = existing_doc['id'] if existing_doc else None
+            if existing_doc:
+                doc_id = existing_doc['id']
+                old_hash = existing_doc['version_hash']
+        
+        # Save uploaded file in chunks to a temporary file, hashing each chunk
+        # as it is written, then swap it in atomically so readers never see a
+        # partly written document. Only one chunk is held in memory at a time
+        tmp_path = f"{filepath}.tmp"
+        digest = new_content_hash()
+        try:
+            with open(tmp_path, "wb") as buffer:
+                while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+                    digest.update(chunk)
+            new_hash = digest.hexdigest()
+            
+            if file_exists:
+                # Create backup; a hard link keeps the previous version
+                # without copying it
+                backup_path = f"{filepath}.backup"
+                _link_or_copy(filepath, backup_path)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        if file_exists:
+            # Hashes stored before the switch to BLAKE2b are MD5 and never
+            # match, so the previous bytes decide whether anything changed;
+            # they are compared chunk by chunk rather than read whole
+            if old_hash != new_hash and files_equal(backup_path, filepath):
+                old_hash = new_hash
             
             # Update existing document
             if old_hash != new_hash:
-                # Document was modified - create diff analysis
-                try:
-                    with open(f"{filepath}.backup", 'r', encoding='utf-8') as f:
-                        old_content = f.read()
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        new_content = f.read()
-                    
-                    # Calculate real diff stats
-                    from reports.diff_utils import calculate_diff_stats
-                    diff_stats = calculate_diff_stats(old_content, new_content)
-                    
+                # Document was modified - create diff analysis. Only
+                # documents up to MAX_DIFF_CHARS bytes (so at most that many
+                # characters) are read in full for it
+                diff_stats = None
+                if max(os.path.getsize(backup_path), os.path.getsize(filepath)) <= MAX_DIFF_CHARS:
+                    try:
+                        with open(backup_path, 'r', encoding='utf-8') as f:
+                            old_content = f.read()
+                        with open(filepath, 'r', encoding='utf-8') as f:
+                            new_content = f.read()
+                        
+                        # Calculate real diff stats
+                        from reports.diff_utils import calculate_diff_stats
+                        diff_stats = calculate_diff_stats(old_content, new_content)
+                    except Exception as e:
+                        print(f"Error analyzing diff: {e}")
+                
+                ml_risk = _risk_score(current_user.id, "update", current_user.department)
+                if diff_stats:
                     # Combine diff-based risk with ML-based risk
-                    diff_risk = min(1.0, diff_stats['change_percentage'] / 100)
-                    ml_risk = analyze_access_pattern(current_user.id, "update", current_user.department)
-                    risk_score = max(diff_risk, ml_risk)
-                    
-                    create_alert(
-                        current_user.id,
-                        file.filename,
-                        "document_modified",
-                        f"Document {file.filename} was modified: {diff_stats['added_lines']} lines added, {diff_stats['removed_lines']} lines removed ({diff_stats['change_percentage']:.1f}% changed)",
-                        risk_score
-                    )
-                except Exception as e:
-                    print(f"Error analyzing diff: {e}")
-                    # Use ML-based risk scoring as fallback
-                    risk_score = analyze_access_pattern(current_user.id, "update", current_user.department)
-                    create_alert(
-                        current_user.id,
-                        file.filename,
-                        "document_modified",
-                        f"Document {file.filename} was modified",
-                        risk_score
-                    )
+                    risk_score = max(min(1.0, diff_stats['change_percentage'] / 100), ml_risk)
+                    description = f"Document {file.filename} was modified: {diff_stats['added_lines']} lines added, {diff_stats['removed_lines']} lines removed ({diff_stats['change_percentage']:.1f}% changed)"
+                else:
+                    # Too large or not decodable to diff: ML-based risk scoring only
+                    risk_score = ml_risk
+                    description = f"Document {file.filename} was modified"
+                
+                create_alert(
+                    current_user.id,
+                    file.filename,
+                    "document_modified",
+                    description,
+                    risk_score
+                )
             else:
                 # No changes detected, use ML risk scoring
-                risk_score = analyze_access_pattern(current_user.id, "update", current_user.department)
+                risk_score = _risk_score(current_user.id, "update", current_user.department)
             
             execute_db_query('''
                 UPDATE documents 
                 SET version_hash = ?, modified_by = ?, updated_at = ?
                 WHERE filepath = ?
             ''', (new_hash, current_user.id, get_current_ist_timestamp(), filepath))
+            if doc_id is not None:
+                _invalidate_document(doc_id)
             
             # Use calculated risk score and determine anomaly flag
             is_anomaly = risk_score >= 0.7 or old_hash != new_hash
@@ -212,7 +326,7 @@ async def upload_document(
                       anomaly_flag=is_anomaly, risk_score=risk_score)
         else:
             # Calculate ML-based risk score for new upload
-            risk_score = analyze_access_pattern(current_user.id, "upload", current_user.department)
+            risk_score = _risk_score(current_user.id, "upload", current_user.department)
             is_anomaly = risk_score >= 0.7
             
             # Create new document record
@@ -225,6 +339,9 @@ async def upload_document(
             log_access(current_user.id, None, file.filename, "upload", 
                       anomaly_flag=is_anomaly, risk_score=risk_score)
         
+        # Modification listings and dashboard counts changed
+        invalidate_cached_responses()
+        _invalidate_document_lists()
         return {"message": "File uploaded successfully", "filename": file.filename}
         
     except HTTPException:
@@ -234,62 +351,63 @@ async def upload_document(
         raise HTTPException(status_code=500, detail="Failed to upload document")
 
 @router.delete("/delete/{doc_id}")
-async def delete_document(doc_id: int, current_user: User = Depends(get_current_user)):
+def delete_document(doc_id: int, current_user: User = Depends(get_current_user)):
     """Delete a document"""
     try:
-        document = execute_db_query(
-            "SELECT * FROM documents WHERE id = ?", 
-            (doc_id,), 
-            fetch_one=True
-        )
+        document = _get_document(doc_id)
         
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Check permissions
-        if current_user.role != "admin" and document['department'] != current_user.department:
+        if not can_access_department(current_user, document['department']):
             # Calculate ML-based risk score for unauthorized delete
-            risk_score = analyze_access_pattern(current_user.id, "unauthorized_delete_attempt", current_user.department)
-            risk_score = max(0.8, risk_score)  # Unauthorized delete is always high risk
+            risk_score = _unauthorized_risk_score(current_user, "unauthorized_delete_attempt")  # Unauthorized delete is always high risk
             
-            log_access(current_user.id, doc_id, document['name'], "unauthorized_delete_attempt", 
-                      anomaly_flag=True, risk_score=risk_score)
-            create_alert(
-                current_user.id,
-                document['name'],
-                "unauthorized_delete",
-                f"User tried to delete {document['department']} document",
-                risk_score
-            )
+            with write_group():
+                log_access(current_user.id, doc_id, document['name'], "unauthorized_delete_attempt", 
+                          anomaly_flag=True, risk_score=risk_score)
+                create_alert(
+                    current_user.id,
+                    document['name'],
+                    "unauthorized_delete",
+                    f"User tried to delete {document['department']} document",
+                    risk_score
+                )
             raise HTTPException(status_code=403, detail="Cannot delete other department documents")
         
         # Calculate ML-based risk score for legitimate delete
-        risk_score = analyze_access_pattern(current_user.id, "delete", current_user.department)
+        risk_score = _risk_score(current_user.id, "delete", current_user.department)
         is_anomaly = risk_score >= 0.7
         
-        # Create backup before deletion
+        # Move the file into the backups directory; on the same filesystem
+        # this is a rename rather than a copy followed by a remove
         filepath = document['filepath']
         if os.path.exists(filepath):
             backup_dir = "static/docs/backups"
-            os.makedirs(backup_dir, exist_ok=True)
+            ensure_dir(backup_dir)
             backup_path = os.path.join(backup_dir, f"deleted_{document['name']}")
-            shutil.copy2(filepath, backup_path)
-            os.remove(filepath)
+            shutil.move(filepath, backup_path)
         
         # Remove from database
         execute_db_query("DELETE FROM documents WHERE id = ?", (doc_id,))
+        invalidate_document_department(doc_id)
+        _invalidate_document(doc_id)
         
         # Log deletion with ML-calculated risk score
-        log_access(current_user.id, doc_id, document['name'], "delete", 
-                  anomaly_flag=is_anomaly, risk_score=risk_score)
-        create_alert(
-            current_user.id,
-            document['name'],
-            "document_deleted",
-            f"Document {document['name']} was deleted",
-            risk_score
-        )
+        with write_group():
+            log_access(current_user.id, doc_id, document['name'], "delete", 
+                      anomaly_flag=is_anomaly, risk_score=risk_score)
+            create_alert(
+                current_user.id,
+                document['name'],
+                "document_deleted",
+                f"Document {document['name']} was deleted",
+                risk_score
+            )
         
+        invalidate_cached_responses()
+        _invalidate_document_lists()
         return {"message": "Document deleted successfully"}
         
     except HTTPException:
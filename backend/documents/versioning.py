@@ -1,32 +1,134 @@
 import hashlib
 import os
+import threading
+from cachetools import LRUCache
 from typing import Optional, Dict
-import difflib
 from datetime import datetime
-import pytz # Import pytz
+from db import INDIA_TIMEZONE
 
-INDIA_TIMEZONE = pytz.timezone('Asia/Kolkata') # Define Indian timezone
+try:
+    # C implementation of difflib's matcher, same interface
+    from cdifflib import CSequenceMatcher as SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+
+# Larger documents are not diffed, in the diff view or on upload, so one
+# huge file cannot tie up a worker or the browser
+MAX_DIFF_CHARS = 1_000_000
+
+FILE_COMPARE_CHUNK_SIZE = 1024 * 1024
+
+# File hashes keyed on path, valid while the file's inode, mtime and size
+# are unchanged; os.replace() swaps in a new inode, so replaced files miss
+_file_hash_cache = LRUCache(maxsize=4096)
+_file_hash_cache_lock = threading.Lock()
+
+# Directories this process has already created or found
+_known_dirs = set()
+
+def ensure_dir(path: str):
+    """os.makedirs(path, exist_ok=True), skipped for directories already seen"""
+    if path not in _known_dirs:
+        os.makedirs(path, exist_ok=True)
+        _known_dirs.add(path)
+
+def new_content_hash():
+    """Hash object used for document version hashes"""
+    # BLAKE2b ships with hashlib and outruns MD5; a 16-byte digest keeps the
+    # 32-character hex length of the MD5 hashes it replaces
+    return hashlib.blake2b(digest_size=16)
+
+def hash_content(data: bytes) -> str:
+    """Version hash of in-memory content"""
+    digest = new_content_hash()
+    digest.update(data)
+    return digest.hexdigest()
+
+def hash_file_object(f) -> str:
+    """Version hash of an open binary file, read in chunks rather than all at once"""
+    if hasattr(hashlib, 'file_digest'): # Python 3.11+
+        return hashlib.file_digest(f, new_content_hash).hexdigest()
+    digest = new_content_hash()
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def files_equal(path_a: str, path_b: str) -> bool:
+    """Compare two files byte for byte, one chunk of each in memory at a time"""
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, 'rb') as a, open(path_b, 'rb') as b:
+        while True:
+            chunk = a.read(FILE_COMPARE_CHUNK_SIZE)
+            if chunk != b.read(FILE_COMPARE_CHUNK_SIZE):
+                return False
+            if not chunk:
+                return True
 
 def calculate_file_hash(filepath: str) -> str:
-    """Calculate MD5 hash of file content"""
+    """Calculate BLAKE2b hash of file content, reused while the file is unchanged"""
     try:
         with open(filepath, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+            # Stat the open file so the key describes the bytes being hashed
+            st = os.fstat(f.fileno())
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            with _file_hash_cache_lock:
+                cached = _file_hash_cache.get(filepath)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            
+            file_hash = hash_file_object(f)
     except FileNotFoundError:
         return ""
+    
+    with _file_hash_cache_lock:
+        _file_hash_cache[filepath] = (key, file_hash)
+    return file_hash
+
+def _unified_range(start: int, stop: int) -> str:
+    """Hunk header range in unified diff notation, as difflib formats it"""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
 
-def get_file_diff(old_content: str, new_content: str) -> Dict:
-    """Get diff between two file contents"""
-    diff_lines = list(difflib.unified_diff(
-        old_content.splitlines(keepends=True),
-        new_content.splitlines(keepends=True),
-        fromfile='Original',
-        tofile='Modified',
-        lineterm=''
-    ))
+def get_file_diff(old_content: str, new_content: str, include_diff: bool = True) -> Dict:
+    """Get diff between two file contents; include_diff=False only counts lines"""
+    old_lines = old_content.splitlines(keepends=True)
+    new_lines = new_content.splitlines(keepends=True)
+    matcher = SequenceMatcher(None, old_lines, new_lines)
     
-    added_lines = sum(1 for line in diff_lines if line.startswith('+') and not line.startswith('+++'))
-    removed_lines = sum(1 for line in diff_lines if line.startswith('-') and not line.startswith('---'))
+    diff_lines = []
+    added_lines = removed_lines = 0
+    if not include_diff:
+        # Counts straight from the opcodes, with no diff lines built
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag in ('replace', 'delete'):
+                removed_lines += i2 - i1
+            if tag in ('replace', 'insert'):
+                added_lines += j2 - j1
+    else:
+        # Same output as difflib.unified_diff(lineterm=''), built from the
+        # matcher's opcodes so the line counts come out of the same pass
+        for group in matcher.get_grouped_opcodes(3):
+            if not diff_lines:
+                diff_lines += ['--- Original', '+++ Modified']
+            first, last = group[0], group[-1]
+            diff_lines.append(f"@@ -{_unified_range(first[1], last[2])} "
+                              f"+{_unified_range(first[3], last[4])} @@")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    diff_lines += [' ' + line for line in old_lines[i1:i2]]
+                    continue
+                if tag in ('replace', 'delete'):
+                    diff_lines += ['-' + line for line in old_lines[i1:i2]]
+                    removed_lines += i2 - i1
+                if tag in ('replace', 'insert'):
+                    diff_lines += ['+' + line for line in new_lines[j1:j2]]
+                    added_lines += j2 - j1
     
     return {
         'diff_lines': diff_lines,
@@ -60,7 +162,7 @@ def backup_file(filepath: str) -> str:
         return ""
     
     backup_dir = os.path.join(os.path.dirname(filepath), 'backups')
-    os.makedirs(backup_dir, exist_ok=True)
+    ensure_dir(backup_dir)
     
     filename = os.path.basename(filepath)
     timestamp = datetime.now(INDIA_TIMEZONE).strftime("%Y%m%d_%H%M%S") # Use IST for backup filename
@@ -0,0 +1,36 @@
+# backend/response_cache.py - Short-lived cache for admin JSON responses
+
+from cachetools import TTLCache
+import orjson
+import asyncio
+import threading
+from fastapi.responses import Response
+
+# Dashboard pollers hit the same aggregates every few seconds; keep the
+# encoded responses in memory for a short while and drop everything when an
+# admin resolves something or a document changes. The cache is per worker
+# process: invalidation only reaches the worker that handled the write, so
+# under several uvicorn workers the others can serve data up to the TTL old
+_response_cache = TTLCache(maxsize=32, ttl=5)
+_response_cache_lock = threading.Lock()
+
+async def cached_json_response(key, build):
+    """Serve build() as orjson-encoded JSON from the short-lived response cache"""
+    with _response_cache_lock:
+        payload = _response_cache.get(key)
+    if payload is None:
+        # sqlite3 blocks, so misses run on a worker thread to keep the
+        # event loop serving other requests
+        payload = await asyncio.to_thread(lambda: orjson.dumps(build()))
+        with _response_cache_lock:
+            _response_cache[key] = payload
+    # no-cache: the browser must come back for every poll, so a refetch
+    # right after resolving an alert sees the invalidated server cache
+    # instead of the browser's own copy
+    return Response(content=payload, media_type="application/json",
+                    headers={"Cache-Control": "private, no-cache"})
+
+def invalidate_cached_responses():
+    """Drop all cached admin responses"""
+    with _response_cache_lock:
+        _response_cache.clear()